@@ -1,10 +1,9 @@
 import matplotlib.pyplot as plt
-import copy,os,sys,time
+import copy,os,sys,time,json,hashlib
 import numpy as np
 from numpy.polynomial.polynomial import Polynomial
 from tqdm.notebook import trange, tqdm
 from scipy.interpolate import interp1d
-from scipy.optimize import minimize
 
 """
 The firmware chooses which input channels to read out.
@@ -23,6 +22,8 @@ class Scan():
     def __init__(self, soc):
         """ initialize with the already loaded TopSoc"""
         self.soc = soc
+        # Unpacking tables for the tones of the last prepRead
+        self.unpackTables = None
 
     def setTones(self, freqsRequested, amplitudes, fis, pfbOutQout=0, verbose=False):
         """
@@ -123,6 +124,7 @@ class Scan():
                 print("Scan.prepRead: i, ch_id, dds_freq =",i, self.inChs[i], self.inOffset[i])
         _,_ = self.soc.chsel.set(self.inChs, debug=debugChselSet)
         self.ntranByTone, self.streamByTone = self.soc.inFreq2NtranStream(self.aliasedToneFreqs)
+        self._unpackTables()
         if verbose:
             print("self.ntranByTone =",self.ntranByTone)
             print("self.streamByTone =",self.streamByTone)
@@ -131,11 +133,19 @@ class Scan():
     def readAndUnpack(self,  nt=1, nsamp=10000,
                       average=False, subtractInputPhase=True,
                       iBegin=0,
-                      debugTransfer=False, unpackVerbose=False):
+                      debugTransfer=False, unpackVerbose=False, reduce=True, padded=False):
+        if average and reduce:
+            # Average straight from the DMA buffer, packets are not kept.
+            self.packets = None
+            xs = self.soc.stream.transfer_mean(nt, nsamp, self.ntranByTone, self.streamByTone,
+                                               iBegin=iBegin, debug=debugTransfer)
+            if subtractInputPhase:
+                xs = self._subtractInputPhase(xs, np.asarray(self.toneFis))
+            return xs.mean(axis=0)
         self.packets = self.soc.stream.transfer(nt=nt, nsamp=nsamp, debug=debugTransfer)
         return self.unpack(unpackVerbose, average,
                            subtractInputPhase=subtractInputPhase,
-                           iBegin=iBegin)
+                           iBegin=iBegin, padded=padded)
         """
         read and unpack data for the tones
             Parameters
@@ -154,6 +164,10 @@ class Scan():
                 use True to print information to stdout; default False
             unpackVerbose : boolean
                 use True to print information to stdout; default False
+            reduce : boolean
+                when averaging, compute the means from the DMA buffer without keeping self.packets; default True
+            padded : boolean
+                without averaging, return padded arrays and lengths (see unpack); default False
        
            Returns
            -------
@@ -161,7 +175,7 @@ class Scan():
         
         """
     
-    def unpack(self, verbose, average, subtractInputPhase=True, iBegin=0):
+    def unpack(self, verbose, average, subtractInputPhase=True, iBegin=0, padded=False):
         """
         unpack the packets
         Parameters
@@ -174,50 +188,86 @@ class Scan():
                 True to subtract the phase of the generated tone; default True
             iBegin : int
                 sample number to begin using; default 0
+            padded : boolean
+                True to return padded arrays and lengths instead of a list of lists; default False
         Returns
         -------
             xs : complex values
             
             The first index indicates the transfer number, of the nt transfers used in the call to readAndUnpack.  The second index is to the tone.
             If average is False, this is a list of lists of ndarrays of complex values.    The ndarray of complex values does not always have the same number of samples, hence the need for a list of lists.
+            If padded is also True, this is instead a tuple (xs, lengths):  xs is a 3D array (nt, nTone, nMax), zero-padded after lengths[it,iTone] samples.
             
             If average is True, this is a 2D array of the average complex value of the samples.
         """
         if verbose: print("self.packets.shape =",self.packets.shape)
-        packets = self.packets[:, iBegin:, :]
-        if verbose: print("     packets.shape =",packets.shape)
-        ntrans = packets[:,:,16]
-        if verbose: print("      ntrans.shape =",ntrans.shape)
-        xis = packets[:,:,0:16:2]
-        if verbose: print("         xis.shape =",xis.shape)
-        xqs = packets[:,:,1:17:2]
-        if verbose: print("         xqs.shape =",xqs.shape)
-        xs = xis + 1j*xqs
+        xs, lengths = self._unpackPadded(self.packets[:, iBegin:, :], subtractInputPhase)
         if verbose: print("          xs.shape =",xs.shape)
-        xsByNtTone = []
-        nt = xs.shape[0]
-        nTone = len(self.ntranByTone)
-        for it in range(nt):
-            xsByTone = []
-            for iTone,(ntran,stream) in enumerate(zip(self.ntranByTone,self.streamByTone)):
-                temp = copy.deepcopy(xs[it, ntrans[it]==ntran, stream])
-                if verbose: print("   nt, iTone , x.shape", it, iTone, temp.shape)
-
-                if subtractInputPhase:
-                    temp = self._subtractInputPhase(temp, 
-                                                self.toneFis[iTone])
-                xsByTone.append(temp)
-            xsByNtTone.append(xsByTone)
+        if verbose: print("     lengths.shape =",lengths.shape)
         if average:
-            retval = np.zeros((nt,nTone), dtype=complex)
-            for it in range(nt):
-                for iTone in range(nTone):
-                    retval[it,iTone] =  xsByNtTone[it][iTone].mean()
+            with np.errstate(invalid='ignore', divide='ignore'):
+                retval = xs.sum(axis=2)/lengths
             retval = retval.mean(axis=0)
+        elif padded:
+            retval = (xs, lengths)
         else:
-            retval = xsByNtTone
+            retval = [[xs[it,iTone,:n] for iTone,n in enumerate(nsByTone)] for it,nsByTone in enumerate(lengths)]
         return retval
 
+    def _unpackTables(self):
+        """
+        Columns and transaction numbers of the tones, rebuilt only when the tones change
+        """
+        ntrans = np.atleast_1d(self.ntranByTone).astype(int)
+        streams = np.atleast_1d(self.streamByTone).astype(int)
+        key = (ntrans.tobytes(), streams.tobytes())
+        if self.unpackTables is None or self.unpackTables['key'] != key:
+            self.unpackTables = {'key' : key,
+                                 'ntrans' : ntrans,
+                                 'ci' : 2*streams,
+                                 'cq' : 2*streams+1,
+                                 'nbins' : ntrans.max(initial=-1)+1}
+        return self.unpackTables
+
+    def _unpackPadded(self, packets, subtractInputPhase=True):
+        """
+        Samples of all tones for all transfers in one gather
+
+        Rows are sorted by (transfer, transaction number) with one stable sort, so the samples of each tone are contiguous and in time order.
+
+        Returns
+        -------
+            xs : ndarray of complex, shape (nt, nTone, nMax), zero-padded
+            lengths : ndarray of int, shape (nt, nTone), number of samples of each tone in each transfer
+        """
+        tables = self._unpackTables()
+        ntrans = tables['ntrans']
+        nbins = tables['nbins']
+        nt, ns = packets.shape[:2]
+
+        # Sort key: transfer and transaction number; other transactions go last.
+        index = packets[:,:,16].astype(int)
+        valid = (index >= 0) & (index < nbins)
+        key = np.where(valid, np.arange(nt)[:,None]*nbins + index, nt*nbins).ravel()
+        order = np.argsort(key, kind='stable')
+        counts = np.bincount(key, minlength=nt*nbins+1)[:nt*nbins]
+        starts = (np.cumsum(counts) - counts).reshape((nt, nbins))
+        counts = counts.reshape((nt, nbins))
+
+        # Rows of every tone of every transfer.
+        lengths = counts[:,ntrans]
+        nMax = lengths.max(initial=0)
+        pos = starts[:,ntrans][:,:,None] + np.arange(nMax)
+        rows = order[np.minimum(pos, max(len(order)-1, 0))]
+
+        flat = packets.reshape((nt*ns, -1))
+        xs = flat[rows, tables['ci'][:,None]] + 1j*flat[rows, tables['cq'][:,None]]
+        xs[np.arange(nMax) >= lengths[:,:,None]] = 0
+
+        if subtractInputPhase:
+            xs *= self._subtractInputPhase(1, np.atleast_1d(self.toneFis))[:,None]
+        return xs, lengths
+
     def _subtractInputPhase(self, x, toneFi):
         """
         Return values with phase of x 
@@ -228,7 +278,7 @@ class Scan():
         # nzSign is:
         #    -1 in odd-numbered Nyquist zones 
         #    +1 in even-number Nyquist zones
-        xrot = np.abs(x)*np.exp(1j * (np.angle(x) + nzSign*toneFi))
+        xrot = x*np.exp(1j*nzSign*toneFi)
         return xrot
 
     def fscan(self, freqs, amps, fis, 
@@ -303,7 +353,7 @@ class Scan():
             self.prepRead(decimation)
             x = self.readAndUnpack(nt, nsamp, average=True,
                             subtractInputPhase=subtractInputPhase,
-                            iBegin=iBegin)
+                            iBegin=iBegin, reduce=not retainPackets)
             if retainPackets:
                 self.retainedPackets.append(self.packets)
             xs[i] =  x  
@@ -371,7 +421,7 @@ class Scan():
     def makeCalibration(self, fMixer, fMin, fMax, nf=100, nt=10, 
                         decimation=2, pfbOutQout=0, verbose=False,
                        randSeed=1234991, iBegin=500, doProgress=True,
-                       nsamp=10000, nominalDelay=None):
+                       nsamp=10000, nominalDelay=None, amp=None):
         """
         For the frequency range, measure I,Q values and prepare for interpolation
         
@@ -403,15 +453,15 @@ class Scan():
                 Number of samples for each transfer; default=10000
             nominalDelay : int
                 Delay to use.  Default=None applies no phase correction due to delay
+            amp : double
+                Amplitude of each tone; default=None uses 0.9/(number of tones)
                 
         """
-        fcMax = max(self.soc.fcIn, self.soc.fcOut)
-        fcMin = min(self.soc.fcIn, self.soc.fcOut)
-        fMinCentered = self.soc.outCh2FreqCenter(self.soc.outFreq2ch(fMin))
-        fMaxCentered = self.soc.outCh2FreqCenter(self.soc.outFreq2ch(fMax))
-        freqs =  np.arange(fMinCentered-fcMax, fMaxCentered+fcMax, self.soc.fcOut)
+        freqs = self.calibrationFreqs(fMin, fMax)
         if verbose: print("Scan.makeCalibration:  len(freqs) =",len(freqs))
-        amps = np.ones(len(freqs))*0.9/len(freqs)
+        if amp is None:
+            amp = 0.9/len(freqs)
+        amps = np.ones(len(freqs))*amp
         np.random.seed(randSeed)
         print("makeCalibration:  all fis zero")
         fis = 0.0*np.random.uniform(0, 2*np.pi, len(freqs))
@@ -431,18 +481,121 @@ class Scan():
         fList = self.makeFList(fMixer, fMin, fMax)
         sFreqs, fAmps, sFis = fscanToSpectrum(fscan)
         sxs = fAmps*np.exp(1j*sFis)
-        cInterps = []
-        for i in range(len(fList)-1):
-            f0 = fList[i]
-            f1 = fList[i+1]
-            inds = (f0 < sFreqs) & (sFreqs < f1)
-            interp = interp1d(sFreqs[inds], sxs[inds], bounds_error=False, fill_value="extrapolate")
-            cInterps.append(interp)
+        cInterps = makeInterps(fList, sFreqs, sxs)
         calib = {"fMixer":fMixer, "fList":fList, "cInterps":cInterps, 
+                 "table":compileCalibration(fList, cInterps),
                  "fMin":fMin, "fMax":fMax, "fscan":fscan,
                  "nominalDelay":nominalDelay} 
         return calib
+
+    def calibrationFreqs(self, fMin, fMax):
+        """
+        Tone frequencies that makeCalibration uses to cover the range fMin to fMax
+        """
+        fcMax = max(self.soc.fcIn, self.soc.fcOut)
+        fMinCentered = self.soc.outCh2FreqCenter(self.soc.outFreq2ch(fMin))
+        fMaxCentered = self.soc.outCh2FreqCenter(self.soc.outFreq2ch(fMax))
+        return np.arange(fMinCentered-fcMax, fMaxCentered+fcMax, self.soc.fcOut)
     
+    def calibrationIdentity(self, fMixer, decimation=2, pfbOutQout=0, nominalDelay=None,
+                            nf=100, nt=10, iBegin=500, nsamp=10000, randSeed=1234991, amp=None):
+        """
+        Settings, and measurement parameters of makeCalibration, that must match for a stored calibration to be reused
+        """
+        bitfile = getattr(self.soc, 'bitfile_name', None)
+        return {"board":getattr(self.soc, 'board', None),
+                "firmware":None if bitfile is None else os.path.basename(bitfile),
+                "firmwareHash":None if bitfile is None else firmwareHash(bitfile),
+                "fMixer":float(fMixer), "decimation":int(decimation), "pfbOutQout":int(pfbOutQout),
+                "nominalDelay":_delayIdentity(nominalDelay),
+                "nf":int(nf), "nt":int(nt), "iBegin":int(iBegin), "nsamp":int(nsamp),
+                "randSeed":None if randSeed is None else int(randSeed),
+                "amp":None if amp is None else float(amp)}
+
+    def cachedCalibration(self, filename, fMixer, fMin, fMax, maxAge=None, nf=100, nt=10,
+                          decimation=2, pfbOutQout=0, verbose=False, doProgress=True,
+                          nominalDelay=None, iBegin=500, nsamp=10000, randSeed=1234991, amp=None, **kwargs):
+        """
+        Same as makeCalibration, keeping the measurements in a .npz file.  Only the ranges of fList that are missing from the file, or older than maxAge, are measured again.
+        
+        Parameters:
+        -----------
+            filename : string
+                the calibration store (.npz); it is created if needed and discarded if its identity (see calibrationIdentity) does not match
+            fMixer, fMin, fMax : double
+                as for makeCalibration
+            maxAge : double
+                maximum age of stored ranges, in seconds; default=None keeps them forever
+            nf, nt, decimation, pfbOutQout, nominalDelay, iBegin, nsamp, randSeed
+                as for makeCalibration; they are part of the identity of the store
+            amp : double
+                amplitude of each tone, the same for every range of the store so their gains match;
+                default=None uses the amplitude of the store, or 0.9/(number of tones) of fMin to fMax for a new store
+            other parameters are passed to makeCalibration
+
+        Returns:
+        --------
+            the calibration, as makeCalibration but without the "fscan" entry
+        """
+        store = None
+        if os.path.exists(filename):
+            store = loadCalibrationStore(filename)
+        if amp is None:
+            # Narrow sub-ranges are measured at the amplitude of the full band
+            amp = 0.9/len(self.calibrationFreqs(fMin, fMax))
+            if store is not None and store['identity'].get('amp') is not None:
+                amp = store['identity']['amp']
+        identity = self.calibrationIdentity(fMixer, decimation, pfbOutQout, nominalDelay,
+                                            nf, nt, iBegin, nsamp, randSeed, amp)
+        if store is not None:
+            if store['identity'] != identity:
+                if verbose: print("Scan cachedCalibration: %s does not match, starting over"%filename)
+                store = None
+        if store is None:
+            store = {"identity":identity, "fLo":np.zeros(0), "fHi":np.zeros(0), "measured":np.zeros(0),
+                     "sFreqs":np.zeros(0), "sxs":np.zeros(0, dtype=complex), "sRange":np.zeros(0, dtype=int)}
+
+        # Ranges of the requested band that are found, and recent enough, in the store
+        fList = self.makeFList(fMixer, fMin, fMax)
+        now = time.time()
+        iStore = np.array([_findRange(store, f0, f1) for f0,f1 in zip(fList[:-1], fList[1:])], dtype=int)
+        fresh = iStore >= 0
+        if maxAge is not None:
+            fresh[fresh] = now - store['measured'][iStore[fresh]] <= maxAge
+
+        # Measure each run of consecutive stale ranges
+        iRange = 0
+        while iRange < len(fresh):
+            if fresh[iRange]:
+                iRange += 1
+                continue
+            iEnd = iRange
+            while iEnd < len(fresh) and not fresh[iEnd]:
+                iEnd += 1
+            if verbose: print("Scan cachedCalibration: measure %.3f to %.3f MHz"%(fList[iRange], fList[iEnd]))
+            calib = self.makeCalibration(fMixer, fList[iRange], fList[iEnd], nf=nf, nt=nt,
+                                         decimation=decimation, pfbOutQout=pfbOutQout, verbose=verbose,
+                                         doProgress=doProgress, nominalDelay=nominalDelay,
+                                         iBegin=iBegin, nsamp=nsamp, randSeed=randSeed, amp=amp, **kwargs)
+            # Age counts from the end of this measurement
+            measured = time.time()
+            for f0, f1 in zip(fList[iRange:iEnd], fList[iRange+1:iEnd+1]):
+                i = _findRange(calib, f0, f1)
+                if i < 0:
+                    raise RuntimeError("Scan cachedCalibration: range %f to %f MHz was not measured"%(f0, f1))
+                _storeRange(store, f0, f1, measured, calib['cInterps'][i].x, calib['cInterps'][i].y)
+            iRange = iEnd
+        if not fresh.all():
+            saveCalibrationStore(filename, store)
+
+        # Calibration from the stored samples of the requested band
+        iStore = np.array([_findRange(store, f0, f1) for f0,f1 in zip(fList[:-1], fList[1:])], dtype=int)
+        inds = np.isin(store['sRange'], iStore)
+        cInterps = makeInterps(fList, store['sFreqs'][inds], store['sxs'][inds])
+        return {"fMixer":fMixer, "fList":fList, "cInterps":cInterps,
+                "table":compileCalibration(fList, cInterps),
+                "fMin":fMin, "fMax":fMax, "nominalDelay":nominalDelay}
+
     def measureNominalDelay(self, outCh, nf=20, nt=1, doProgress=False, doPlot=False, decimation=32, iBegin=500, pfbOutQout=0, nsamp=10000):
         """
         Measure the nominal delay between the input and ouput DDS
@@ -471,32 +624,13 @@ class Scan():
            the measured delay, in micro seconds 
                
         """
-        freqs = np.array([self.soc.outCh2FreqCenter(outCh)])
-        amps = np.array([0.9])
-        fis = np.array([0.0])
-        bandwidth = self.soc.fcOut / 100
-        self.mndScan = self.fscan(freqs, amps, fis, 
-                                  bandwidth, nf, decimation, nt,
-                      iBegin, nsamp, pfbOutQout, doProgress=doProgress)
-       
-        iTone = 0
-        
-        self.dfs = self.mndScan['dfs']
-        
-        fTone = freqs[0]
-        freqs = fTone + self.mndScan['dfs']
-        aliasedFreqs = self.soc.fAliasedFromFTone(freqs)
-        aliasedFTone = self.soc.fAliasedFromFTone(fTone)
-        self.dfsAliased = aliasedFreqs - aliasedFTone
-        self.xs = self.mndScan['xs'][:,0]
-        phi0 = np.angle(self.xs[len(self.xs)//2])
-        guess = np.array([phi0, 0.0])
-        
-        rv = minimize(_minimizeDelayFun, guess, args=(self.dfsAliased, self.xs))
-        nominalDelay = rv.x[1]
+        delays = self.measureDelays([outCh], nf=nf, nt=nt, doProgress=doProgress,
+                                    decimation=decimation, iBegin=iBegin,
+                                    pfbOutQout=pfbOutQout, nsamp=nsamp)
+        nominalDelay = delays['delays'][0]
         if doPlot:
-            phi0 = rv.x[0]
-            delay = rv.x[1]
+            phi0 = delays['phis'][0]
+            delay = nominalDelay
             dfFits = np.linspace(self.dfsAliased.min(),self.dfsAliased.max(),100)
             xFits = np.exp(1j*(phi0 + delay*dfFits))
             plt.plot(self.dfsAliased,np.real(self.xs)/np.abs(self.xs),'b.', label="data I")
@@ -527,6 +661,53 @@ class Scan():
         #        plt.suptitle("outCh=%d DDSDelay = %f $\mu$sec"%(outCh,nominalDelay))
         return nominalDelay
 
+    def measureDelays(self, outChs, nf=20, nt=1, doProgress=False, decimation=32, iBegin=500, pfbOutQout=0, nsamp=10000):
+        """
+        Measure the delay between the input and output DDS for many output channels with one scan
+
+        One tone is set at the center of each output channel and the phase of each tone is fit
+        to a line with estimateDelays.
+
+        Parameters:
+        -----------
+            outChs : list of int
+                the output channels to use for this measurement
+            nf, nt, doProgress, decimation, iBegin, pfbOutQout, nsamp
+                as for measureNominalDelay
+
+        Returns:
+        --------
+            a delay map, sorted by frequency, with these keys:
+                outChs : the output channels
+                freqs : the tone frequencies (MHz)
+                delays : the delay of each tone, in the units of measureNominalDelay
+                phis : the phase at the tone frequency, in radians
+                fMixer : the mixer setting, in MHz
+            It can be used as the delay of applyDelay and as the nominalDelay of makeCalibration.
+        """
+        outChs = np.unique(outChs)
+        freqs = np.array([self.soc.outCh2FreqCenter(outCh) for outCh in outChs])
+        amps = np.full(len(freqs), 0.9/len(freqs))
+        fis = np.zeros(len(freqs))
+        bandwidth = self.soc.fcOut / 100
+        self.mndScan = self.fscan(freqs, amps, fis,
+                                  bandwidth, nf, decimation, nt,
+                      iBegin, nsamp, pfbOutQout, doProgress=doProgress)
+
+        self.dfs = self.mndScan['dfs']
+        # Aliased offsets:  first index is the frequency offset, second the tone
+        aliasedFreqs = self.soc.fAliasedFromFTone(freqs[None,:] + self.dfs[:,None])
+        self.dfsAliased = aliasedFreqs - self.soc.fAliasedFromFTone(freqs)[None,:]
+        delays, phis = estimateDelays(self.dfsAliased, self.mndScan['xs'])
+
+        # Single tone views, as plotted by measureNominalDelay
+        self.xs = self.mndScan['xs'][:,0]
+        self.dfsAliased = self.dfsAliased[:,0]
+
+        inds = np.argsort(freqs)
+        return {"outChs":outChs[inds], "freqs":freqs[inds], "delays":delays[inds],
+                "phis":phis[inds], "fMixer":self.soc.get_mixer()}
+
     #apply delay and apply calibration need to be methods of Scan so we can use aliased frequencies beyond the first Nyquist zone
 
     def applyDelay(self, fscan, delay):
@@ -537,28 +718,31 @@ class Scan():
         -----------
             fscan : object
                 returned from the function fscan.
-            delay : float
-                time delay between DDS blocks, in microseconds, usually calculate by the function measureNominalDelay
+            delay : float or dict
+                time delay between DDS blocks, in microseconds, usually calculate by the function measureNominalDelay,
+                or a delay map from measureDelays, interpolated at each tone
 
         Return:
         -------
             None, as the fscan object is updated in place
         """
-        print(" Scan applyDelay:  apply delay =",delay)
+        delays = delayAt(delay, fscan['freqs'])
+        if isinstance(delay, dict):
+            print(" Scan applyDelay:  apply delay map, delay from %f to %f"%(np.min(delays),np.max(delays)))
+        else:
+            print(" Scan applyDelay:  apply delay =",delay)
         try:
-            fscan['delayApplied'] += delay
+            fscan['delayApplied'] = fscan['delayApplied'] + delays
         except KeyError:
-            fscan['delayApplied'] =  delay
-        for iTone in range(fscan['xs'].shape[1]):
-            xs = fscan['xs'][:,iTone]
-            freqs = fscan['dfs'] + fscan['freqs'][iTone]
-            aliasedFreqs = self.soc.fAliasedFromFTone(freqs)
-            fscan['xs'][:,iTone] = np.abs(xs)*np.exp( 1j*(np.angle(xs) - delay*aliasedFreqs) )
-            #fscan['xs'][:,iTone] = np.abs(xs)*np.exp( 1j*(np.angle(xs) - delay*freqs) )
+            fscan['delayApplied'] =  delays
+        # All tones at once:  first index is the frequency offset, second the tone
+        freqs = fscan['dfs'][:,None] + fscan['freqs'][None,:]
+        aliasedFreqs = self.soc.fAliasedFromFTone(freqs)
+        fscan['xs'] *= np.exp(-1j*delays*aliasedFreqs)
 
     def applyDelayToX(self, xs, freqs, delay):
         aliasedFreqs = self.soc.fAliasedFromFTone(freqs)
-        xsd = np.abs(xs)*np.exp(1j*(np.angle(xs) - delay*aliasedFreqs))
+        xsd = xs*np.exp(-1j*delayAt(delay, freqs)*aliasedFreqs)
         return xsd
     
     def applyCalibration(self, fscan, calibration, amplitudeMax=30000):
@@ -581,20 +765,16 @@ class Scan():
         fscanCalib = copy.deepcopy(fscan)
         nominalDelay = calibration['nominalDelay']
         self.applyDelay(fscanCalib, nominalDelay)
-        if nominalDelay != fscanCalib['delayApplied']:
+        if np.any(delayAt(nominalDelay, fscanCalib['freqs']) != fscanCalib['delayApplied']):
             raise ValueError("fscan already had a delay applied", nominalDelay, fscanCalib['delayApplied'])
+        table = calibration.get('table')
+        if table is None:
+            table = compileCalibration(calibration['fList'], calibration['cInterps'])
         dfs = fscanCalib['dfs']
-        for iTone,(freq,xs) in enumerate(zip(fscanCalib['freqs'],fscanCalib['xs'])):
-            freqs = freq+dfs
-            xCalib = np.zeros(len(freqs), dtype=complex)
-            for i, freq in enumerate(freqs):
-                iCalib = np.searchsorted(calibration['fList'], freq)-1 
-                xCalib[i] = calibration['cInterps'][iCalib](freq)
-            gain = (0.9/len(freqs))*amplitudeMax/np.abs(xCalib)
-            fscanCalib['xs'][:,iTone] *= gain
-            dfi = np.angle(xCalib)
-            xs = fscanCalib['xs'][:,iTone]
-            fscanCalib['xs'][:,iTone] = np.abs(xs)*np.exp(1j*(np.angle(xs)-dfi))
+        freqs = dfs[:,None] + fscanCalib['freqs'][None,:]
+        xCalib = evaluateCalibration(table, freqs)
+        # Scale by gain/|xCalib| and rotate by -angle(xCalib) in one step
+        fscanCalib['xs'] *= (0.9/len(dfs))*amplitudeMax/xCalib
         return fscanCalib                                                     
 
 
@@ -657,6 +837,133 @@ def fscanToSpectrum(fscan):
     return allfreqs[inds], allamps[inds], allfis[inds]
    
         
+def makeInterps(fList, sFreqs, sxs):
+    """
+    one linear interpolation (with extrapolation) per range of fList, from the calibration samples (sFreqs, sxs) inside the range
+    """
+    cInterps = []
+    for i in range(len(fList)-1):
+        f0 = fList[i]
+        f1 = fList[i+1]
+        inds = (f0 < sFreqs) & (sFreqs < f1)
+        interp = interp1d(sFreqs[inds], sxs[inds], bounds_error=False, fill_value="extrapolate")
+        cInterps.append(interp)
+    return cInterps
+
+def saveCalibrationStore(filename, store):
+    """
+    write the calibration store to a .npz file (written to a temporary file first, then renamed)
+    
+    Parameters:
+    -----------
+        store : dict
+            identity (dict), fLo, fHi and measured (time.time()) for each range, and the samples sFreqs, sxs with sRange, the index of their range
+    """
+    tmp = filename + ".tmp"
+    with open(tmp, 'wb') as f:
+        np.savez_compressed(f, identity=np.array(json.dumps(store['identity'])),
+                            fLo=store['fLo'], fHi=store['fHi'], measured=store['measured'],
+                            sFreqs=store['sFreqs'], sxs=store['sxs'], sRange=store['sRange'])
+    os.replace(tmp, filename)
+
+def loadCalibrationStore(filename):
+    """
+    read a calibration store written by saveCalibrationStore
+    """
+    with np.load(filename, allow_pickle=False) as data:
+        store = {key:data[key] for key in data.files}
+    store['identity'] = json.loads(str(store['identity']))
+    return store
+
+def firmwareHash(bitfile):
+    """
+    sha256 of the .hwh file next to the bitfile (of the bitfile if there is no .hwh), None if it can not be read
+    """
+    path = os.path.splitext(bitfile)[0] + '.hwh'
+    if not os.path.isfile(path):
+        path = bitfile
+    h = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+def _findRange(calib, f0, f1):
+    """
+    index of the range (f0,f1) in a calibration (fList) or a store (fLo, fHi), -1 if not there
+    """
+    if 'fList' in calib:
+        fLo, fHi = calib['fList'][:-1], calib['fList'][1:]
+    else:
+        fLo, fHi = calib['fLo'], calib['fHi']
+    inds = np.nonzero(np.isclose(fLo, f0, rtol=0, atol=1e-6) & np.isclose(fHi, f1, rtol=0, atol=1e-6))[0]
+    return inds[0] if len(inds) > 0 else -1
+
+def _storeRange(store, f0, f1, measured, sFreqs, sxs):
+    """
+    add or replace the samples of the range (f0,f1) in the store
+    """
+    i = _findRange(store, f0, f1)
+    if i < 0:
+        i = len(store['fLo'])
+        store['fLo'] = np.append(store['fLo'], f0)
+        store['fHi'] = np.append(store['fHi'], f1)
+        store['measured'] = np.append(store['measured'], measured)
+    else:
+        store['measured'][i] = measured
+        keep = store['sRange'] != i
+        for key in ('sFreqs', 'sxs', 'sRange'):
+            store[key] = store[key][keep]
+    store['sFreqs'] = np.append(store['sFreqs'], sFreqs)
+    store['sxs'] = np.append(store['sxs'], sxs)
+    store['sRange'] = np.append(store['sRange'], np.full(len(sFreqs), i, dtype=int))
+
+def compileCalibration(fList, cInterps):
+    """
+    compile the calibration into one piecewise-linear table
+
+    Parameters:
+    -----------
+        fList : ndarray
+            boundaries of the calibration ranges (in MHz), as returned by makeFList
+        cInterps : list
+            one interp1d per range, as made by makeCalibration
+
+    Returns:
+    --------
+        table : dict
+            fb : ndarray, sorted breakpoints (in MHz)
+            a, b : ndarrays of complex, the calibration is a[j] + b[j]*f for fb[j] < f <= fb[j+1]
+
+        The first and last pieces of each range extrapolate linearly, as the interp1d objects do.
+    """
+    fb, a, b = [], [], []
+    for f0, interp in zip(fList[:-1], cInterps):
+        x, iu = np.unique(interp.x, return_index=True)
+        y = np.asarray(interp.y)[iu]
+        if len(x) < 2:
+            fb.append(f0)
+            a.append(np.nan)
+            b.append(np.nan)
+            continue
+        slope = np.diff(y)/np.diff(x)
+        fb.extend([f0] + list(x[1:-1]))
+        a.extend(y[:-1] - slope*x[:-1])
+        b.extend(slope)
+    fb.append(fList[-1])
+    return {"fb":np.array(fb), "a":np.array(a, dtype=complex), "b":np.array(b, dtype=complex)}
+
+def evaluateCalibration(table, freqs):
+    """
+    evaluate the compiled calibration at the frequencies (any shape, in MHz); values outside of the table are extrapolated from the first or last piece
+    """
+    freqs = np.asarray(freqs)
+    j = np.clip(np.searchsorted(table['fb'], freqs)-1, 0, len(table['a'])-1)
+    return table['a'][j] + table['b'][j]*freqs
+
 def _unwrapPhis(phis, sign=1):
     """
     Increment (or decrement) values after a large change in phase to unwrap them
@@ -667,17 +974,70 @@ def _unwrapPhis(phis, sign=1):
             uphis[i:] += 2*np.pi
     return sign*uphis
 
-def _minimizeDelayFun(pars, dfs, xs):
-    phiFits = pars[0] + pars[1]*dfs
-    phiData = np.angle(xs)
-    dPhis = np.angle(np.exp(1j*(phiFits-phiData)))
-    retval = np.power(dPhis,2).mean()
-    return retval
+def estimateDelays(dfs, xs, weights=None):
+    """
+    Fit the phase of each tone to phi0 + delay*dfs, all tones at once and in closed form
+
+    Parameters:
+    -----------
+        dfs : ndarray
+            frequency offsets (MHz), shape (nf,) or (nf,nTone)
+        xs : ndarray of complex
+            measured values, shape (nf,) or (nf,nTone)
+        weights : ndarray or None
+            weight of each value; default |xs|**2
+
+    Returns:
+    --------
+        delays, phi0s : the slope (radians/MHz) and the phase at dfs=0 of each tone
+    """
+    xs = np.asarray(xs)
+    dfs = np.asarray(dfs, dtype=float)
+    if dfs.ndim < xs.ndim:
+        dfs = dfs[:,None]
+    dfs = np.broadcast_to(dfs, xs.shape)
+    if weights is None:
+        weights = np.abs(xs)**2
+    weights = np.broadcast_to(weights, xs.shape)
+
+    coarse = np.angle((xs[1:]*np.conj(xs[:-1])).sum(axis=0))/(dfs[1:]-dfs[:-1]).mean(axis=0)
+    phis = np.unwrap(np.angle(xs*np.exp(-1j*coarse*dfs)), axis=0)
+    sw = weights.sum(axis=0)
+    mx = (weights*dfs).sum(axis=0)/sw
+    my = (weights*phis).sum(axis=0)/sw
+    dx = dfs - mx
+    slope = (weights*dx*(phis-my)).sum(axis=0)/(weights*dx*dx).sum(axis=0)
+    delays = coarse + slope
+    phi0s = np.angle(np.exp(1j*(my - slope*mx)))
+    return delays, phi0s
+
+def delayAt(delay, freqs):
+    """
+    The delay at each frequency:  a float is returned as it is, a delay map from
+    Scan.measureDelays is interpolated linearly
+    """
+    if isinstance(delay, dict):
+        return np.interp(freqs, delay['freqs'], delay['delays'])
+    return delay
+
+def _delayIdentity(delay):
+    if delay is None:
+        return None
+    if isinstance(delay, dict):
+        return {"freqs":[float(f) for f in delay['freqs']],
+                "delays":[float(d) for d in delay['delays']]}
+    return float(delay)
 
 def plotCalibrationAndScan(fStart, fEnd, calibration, scan=None, fList=None, doIQ=False):
     if fList is None:
         fList = calibration['fList']
-    cSpectrum = fscanToSpectrum(calibration['fscan'])
+    if 'fscan' in calibration:
+        cSpectrum = fscanToSpectrum(calibration['fscan'])
+    else:
+        # Calibration from a store: use the samples of the interpolations
+        sFreqs = np.concatenate([interp.x for interp in calibration['cInterps']])
+        sxs = np.concatenate([interp.y for interp in calibration['cInterps']])
+        cSpectrum = (sFreqs, np.abs(sxs), np.angle(sxs))
     cInds = (cSpectrum[0] > fStart ) & (cSpectrum[0] < fEnd)
     cAmp = cSpectrum[1]
     cPha = cSpectrum[2]
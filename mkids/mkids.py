@@ -499,49 +499,107 @@ class AxisStreamerV1(SocIp):
         
 
         for i in np.arange(nt):
-            if debug:
-                print('AxisStreamer: Checking DMA idle')
+            self.transfer_buff(debug)
 
-            # DMA must be Idle.
+            # Data format:
+            # Each streamer transaction is 512 bits. 
+            # It contains 8 samples (32-bit each) plus 1 sample (16-bit) for TUSER.
+            # The upper 15 samples are filled with zeros.
+            data[i,:,:] = self.buff.reshape((-1, self.NS_TR))[:self.nsamp_reg,:self.NS_NI]
+
+        return data
+
+    def transfer_buff(self, debug=False):
+        """
+        One DMA transfer of nsamp_reg transactions into self.buff (see set_nsamp).
+        """
+        if debug:
+            print('AxisStreamer: Checking DMA idle')
+
+        # DMA must be Idle.
+        if not self.idle():
+            raise RuntimeError('DMA Channel must be IDLE to start new transfer')
+
+        if debug:
+            print('AxisStreamer: Starting DMA')
+        
+        # Start DMA.
+        self.dma.recvchannel.transfer(self.buff, nbytes=int(self.nsamp_reg*self.NS_TR*2))
+
+        # Wait until DMA shows idle to start transferring.
+        while True:
             if not self.idle():
-                raise RuntimeError('DMA Channel must be IDLE to start new transfer')
+                break;
 
-            if debug:
-                print('AxisStreamer: Starting DMA')
+        if debug:
+            print('AxisStreamer: Starting streamer')
+
+        # Start streamer.
+        self.start()
+
+        if debug:
+            print('AxisStreamer: Waiting DMA to finish')
         
-            # Start DMA.
-            self.dma.recvchannel.transfer(self.buff, nbytes=int(self.nsamp_reg*self.NS_TR*2))
+        # Wait until transfer is done.
+        self.dma.recvchannel.wait()
 
-            # Wait until DMA shows idle to start transferring.
-            while True:
-                if not self.idle():
-                    break;
+        if debug:
+            print('AxisStreamer: Stopping streamer')
+        
+        # Stop streamer.
+        self.stop()
 
-            if debug:
-                print('AxisStreamer: Starting streamer')
+    def transfer_mean(self, nt, nsamp, ntrans, streams, iBegin=0, debug=False):
+        """
+        Average of each tone for each DMA transfer, computed from the int16 DMA buffer.
 
-            # Start streamer.
-            self.start()
+        Equivalent to averaging the output of transfer(), but the packets are never copied:
+        for each transfer, samples are summed per transaction number with one bincount per column.
 
-            if debug:
-                print('AxisStreamer: Waiting DMA to finish')
-            
-            # Wait until transfer is done.
-            self.dma.recvchannel.wait()
+        Parameters:
+        -----------
+            nt: int
+                number of dma transfers
+            nsamp: int
+                number of streamer transactions per transfer
+            ntrans: ndarray of ints
+                transaction number of each tone
+            streams: ndarray of ints
+                stream (index within the transaction) of each tone
+            iBegin: int (Default 0)
+                number of transactions to skip at the beginning of each transfer
+
+        Returns:
+        --------
+            xs: ndarray of complex, shape (nt, ntone)
+        """
+        ntrans = np.atleast_1d(ntrans).astype(int)
+        streams = np.atleast_1d(streams).astype(int)
 
-            if debug:
-                print('AxisStreamer: Stopping streamer')
-            
-            # Stop streamer.
-            self.stop()
-                
-            # Data format:
-            # Each streamer transaction is 512 bits. 
-            # It contains 8 samples (32-bit each) plus 1 sample (16-bit) for TUSER.
-            # The upper 15 samples are filled with zeros.        
-            data[i,:,:] = self.buff.reshape((-1, self.NS_TR))[:self.nsamp_reg,:self.NS_NI]
+        self.set_nsamp(nsamp)
 
-        return data
+        nbins = int(ntrans.max(initial=-1)) + 1
+        xs = np.zeros((nt, len(ntrans)), dtype=complex)
+        for i in np.arange(nt):
+            self.transfer_buff(debug)
+
+            packets = self.buff.reshape((-1, self.NS_TR))[iBegin:self.nsamp_reg,:self.NS_NI]
+            index = packets[:,self.NS].astype(int)
+
+            # Only transactions of interest.
+            valid = (index >= 0) & (index < nbins)
+            index = index[valid]
+
+            # Sum I and Q of every stream per transaction number.
+            counts = np.bincount(index, minlength=nbins)
+            sums = np.zeros((self.NS, nbins))
+            for k in np.arange(self.NS):
+                sums[k] = np.bincount(index, weights=packets[valid,k], minlength=nbins)
+
+            with np.errstate(invalid='ignore', divide='ignore'):
+                xs[i] = (sums[2*streams, ntrans] + 1j*sums[2*streams+1, ntrans])/counts[ntrans]
+
+        return xs
 
     def transfer_orig(self, nt=1, debug=False):
         # Data structure:
@@ -612,16 +670,42 @@ class AxisStreamerV1(SocIp):
                 
         return [xi,xq]
     
-    async def transfer_async(self):
-        # DMA data.
-        self.dma.recvchannel.transfer(self.buff)
-        await self.dma.recvchannel.wait_async()
+    async def transfer_async(self, nt=1, nsamp=None):
+        # Same as transfer(), but waiting for the DMA does not block the event loop.
+        # nsamp=None keeps the current number of samples (see set_nsamp).
+        if nsamp is not None:
+            self.set_nsamp(nsamp)
+        elif self.buff is None:
+            raise RuntimeError("nsamp must be given before the first transfer")
 
-        # Format data.
-        data = self.buff & 0xFFFFF;
-        indx = (self.buff >> 24) & 0xFF;
+        data = np.zeros((nt,self.nsamp_reg,self.NS_NI), dtype=self.DTYPE)
 
-        return [indx,data]
+        for i in np.arange(nt):
+            # DMA must be Idle.
+            if not self.idle():
+                raise RuntimeError('DMA Channel must be IDLE to start new transfer')
+
+            # Start DMA.
+            self.dma.recvchannel.transfer(self.buff, nbytes=int(self.nsamp_reg*self.NS_TR*2))
+
+            # Wait until DMA shows idle to start transferring.
+            while True:
+                if not self.idle():
+                    break;
+
+            # Start streamer.
+            self.start()
+
+            # Wait until transfer is done (yields to the event loop).
+            await self.dma.recvchannel.wait_async()
+
+            # Stop streamer.
+            self.stop()
+
+            # Same packet format as transfer().
+            data[i,:,:] = self.buff.reshape((-1, self.NS_TR))[:self.nsamp_reg,:self.NS_NI]
+
+        return data
 
 class AxisDdsV3(SocIp):
     bindto = ['user.org:user:axis_dds_v3:1.0']
@@ -418,16 +418,39 @@ class AxisStreamerV1(SocIp):
                 
         return [xi,xq]
 
-    async def transfer_async(self):
-        # DMA data.
-        self.dma.recvchannel.transfer(self.buff)
-        await self.dma.recvchannel.wait_async()
+    async def transfer_async(self, nt=1, nsamp=None):
+        # Same as transfer(), but waiting for the DMA does not block the event loop.
+        if nsamp is not None:
+            if nsamp != self.nsamp_reg:
+                raise ValueError("nsamp=%d is not equal to self.nsamp_reg=%d"%(nsamp, self.nsamp_reg))
+        data = np.zeros((nt,self.nsamp_reg,self.NS_NI))
 
-        # Format data.
-        data = self.buff & 0xFFFFF;
-        indx = (self.buff >> 24) & 0xFF;
+        for i in np.arange(nt):
+            # DMA must be Idle.
+            if not self.idle():
+                raise RuntimeError('DMA Channel must be IDLE to start new transfer')
 
-        return [indx,data]
+            # Start DMA.
+            self.dma.recvchannel.transfer(self.buff)
+
+            # Wait until DMA shows idle to start transferring.
+            while True:
+                if not self.idle():
+                    break;
+
+            # Start streamer.
+            self.start()
+
+            # Wait until transfer is done (yields to the event loop).
+            await self.dma.recvchannel.wait_async()
+
+            # Stop streamer.
+            self.stop()
+
+            # Same packet format as transfer().
+            data[i,:,:] = self.buff.reshape((self.nsamp_reg, -1))[:,:self.NS_NI]
+
+        return data
 
 class AxisDdsV2(SocIp):
     bindto = ['user.org:user:axis_dds_v2:1.0']
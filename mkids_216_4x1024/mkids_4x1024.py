@@ -442,16 +442,42 @@ class AxisStreamerV1(SocIp):
         data_iq = packets[:,:,:16].reshape((-1,16))
         return data_iq
 
-    async def transfer_async(self):
-        # DMA data.
-        self.dma.recvchannel.transfer(self.buff)
-        await self.dma.recvchannel.wait_async()
+    async def transfer_async(self, nt=1, nsamp=None):
+        # Same as transfer(), but waiting for the DMA does not block the event loop.
+        # nsamp=None keeps the current number of samples (see set_nsamp).
+        if nsamp is not None:
+            self.set_nsamp(nsamp)
+        elif self.buff is None:
+            raise RuntimeError("nsamp must be given before the first transfer")
 
-        # Format data.
-        data = self.buff & 0xFFFFF;
-        indx = (self.buff >> 24) & 0xFF;
+        data = np.zeros((nt,self.nsamp_reg,self.NS_NI), dtype=self.DTYPE)
+
+        for i in np.arange(nt):
+            # DMA must be Idle.
+            if not self.idle():
+                raise RuntimeError('DMA Channel must be IDLE to start new transfer')
 
-        return [indx,data]
+            # Start DMA.
+            self.dma.recvchannel.transfer(self.buff, nbytes=int(self.nsamp_reg*self.NS_TR*2))
+
+            # Wait until DMA shows idle to start transferring.
+            while True:
+                if not self.idle():
+                    break;
+
+            # Start streamer.
+            self.start()
+
+            # Wait until transfer is done (yields to the event loop).
+            await self.dma.recvchannel.wait_async()
+
+            # Stop streamer.
+            self.stop()
+
+            # Same packet format as transfer().
+            data[i,:,:] = self.buff.reshape((-1, self.NS_TR))[:self.nsamp_reg,:self.NS_NI]
+
+        return data
 
 class AxisDdsV3(SocIp):
     bindto = ['user.org:user:axis_dds_v3:1.0']
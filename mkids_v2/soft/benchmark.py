@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of the tone programming and readout paths.
+
+They run on the simulated backend (simsoc.py), so the numbers measure the software: register
+writes go to memory and DMA buffers are filled with synthetic packets. Give a DMA latency and
+bandwidth to include a model of the transfer time.
+
+Usage:
+    python benchmark.py [-f hwhfile] [-o results.json] [-r repeat] [-l latency] [-b bandwidth] [-k name]
+
+Results are printed and, with -o, written as JSON: a 'meta' dictionary (versions, settings) and
+a list of 'results', each with the benchmark name, its parameters and statistics of the run
+times in seconds.
+"""
+import os, sys, getopt, json, time, platform
+import importlib.util
+import numpy as np
+from scipy.interpolate import interp1d
+
+from simsoc import *
+
+
+# Default hardware description.
+HWH = '../zcu216/mkids_2x2_kidsim_v1.hwh'
+
+# Legacy Scan (mkids/Scan.py), for applyCalibration.
+LEGACY_SCAN = '../../mkids/Scan.py'
+
+def timeit(fn, repeat=10, setup=None):
+    """
+    Run fn repeat times and return statistics of the run times.
+
+    Parameters:
+    -----------
+        fn: function
+            code to time, called with the arguments returned by setup
+        repeat: int (Default 10)
+            number of runs
+        setup: function or None (Default None)
+            untimed preparation before each run, returning a tuple of arguments for fn
+
+    Returns:
+    --------
+        dict with 'repeat', 'mean', 'std', 'min', 'median' and 'max' (seconds)
+    """
+    ts = np.zeros(repeat)
+    for i in range(repeat):
+        args = () if setup is None else setup()
+        t0 = time.perf_counter()
+        fn(*args)
+        ts[i] = time.perf_counter() - t0
+
+    return {'repeat' : repeat, 'mean' : ts.mean(), 'std' : ts.std(), 'min' : ts.min(),
+            'median' : np.median(ts), 'max' : ts.max()}
+
+class Benchmarks():
+    """
+    Benchmark suite on one simulated board. Each bench_* method returns a list of results.
+    """
+    # Tone counts.
+    NTONES = [1, 64, 1024]
+
+    # Streamer samples per transfer and transfers.
+    NSAMPS = [1000, 10000, 100000]
+    NTS = [1, 10]
+
+    # Points of phase_fit.
+    NPOINTS = [1000, 10000, 100000]
+
+    def __init__(self, hwhfile=HWH, latency=0, bandwidth=None, repeat=10, seed=0):
+        self.hwhfile = hwhfile
+        self.repeat = repeat
+        self.rng = np.random.default_rng(seed)
+
+        self.soc = SimMkidsSoc(hwhfile, latency=latency, bandwidth=bandwidth, seed=seed)
+        self.chain = KidsChain(self.soc, dual=self.soc['dual'][0])
+
+        # Blocks.
+        self.pfb = getattr(self.soc, self.chain.synthesis.dict['chain']['pfb'])
+        self.chsel = getattr(self.soc, self.chain.analysis.dict['chain']['chsel'])
+        self.streamer = getattr(self.soc, self.chain.analysis.dict['chain']['streamer'])
+        self.nch = self.pfb.dict['N']
+        self.nch_in = self.chsel.NCH
+
+    def result(self, name, params, stats):
+        print("%-24s %-40s mean = %10.3f ms, min = %10.3f ms" %
+              (name, ", ".join("%s=%s" % (k, v) for k, v in params.items()), 1e3*stats['mean'], 1e3*stats['min']))
+        return {'name' : name, 'params' : params, 'stats' : stats}
+
+    def ntones(self, nch):
+        # Tone counts that fit in nch channels.
+        return sorted(set(min(n, nch) for n in self.NTONES))
+
+    def random_tones(self, n):
+        """
+        Frequencies of n tones in different channels, away from the channel edges.
+        """
+        chs = self.rng.choice(self.nch, size=n, replace=False)
+        f = self.chain.synthesis.ch2freq(chs)
+
+        # Offset towards the mixer frequency: the edge channel is centered at -fs/2.
+        df = self.rng.uniform(0, 0.25, len(chs))*self.chain.synthesis.fc_ch
+        return f - np.sign(f - self.chain.synthesis.get_mixer_frequency())*df
+
+    def set_tones(self, freqs):
+        n = len(freqs)
+        self.chain.set_tones(freqs, np.zeros(n), np.full(n, 0.9/n))
+
+    def bench_set_tones(self):
+        results = []
+        for n in self.ntones(self.nch):
+            # All tones change on every call.
+            setup = lambda: (self.random_tones(n),)
+            stats = timeit(self.set_tones, self.repeat, setup)
+            results.append(self.result('set_tones', {'ntone' : n, 'update' : 'all'}, stats))
+
+            # Same tones again: nothing to write.
+            freqs = self.random_tones(n)
+            self.set_tones(freqs)
+            stats = timeit(lambda: self.set_tones(freqs), self.repeat)
+            results.append(self.result('set_tones', {'ntone' : n, 'update' : 'none'}, stats))
+        return results
+
+    def bench_set_mask(self):
+        results = []
+        for n in self.ntones(self.nch_in):
+            setup = lambda: (self.rng.choice(self.nch_in, size=n, replace=False),)
+            stats = timeit(self.chsel.set_mask, self.repeat, setup)
+            results.append(self.result('chsel_set_mask', {'nch' : n}, stats))
+        return results
+
+    def bench_streamer(self):
+        results = []
+
+        # Channels of 64 tones.
+        ntrans, idxs = self.chsel.set_mask(self.rng.choice(self.nch_in, size=min(64, self.nch_in), replace=False))
+
+        # Transfers replay a recorded buffer: the time of the synthetic source is not measured.
+        recv = self.streamer.dma.recvchannel
+        source = recv.source
+
+        for nsamp in self.NSAMPS:
+            self.streamer.set(nsamp)
+            buff = sim_allocate(nsamp*self.streamer.NS_TR, dtype=self.streamer.DTYPE)
+            source(buff)
+            recv.source = SimReplaySource(buff)
+            for nt in self.NTS:
+                stats = timeit(lambda: self.streamer.transfer(nt), self.repeat)
+                results.append(self.result('streamer_transfer', {'nsamp' : nsamp, 'nt' : nt}, stats))
+
+                # Decode of recorded packets.
+                packets = self.streamer.transfer(nt)
+                stats = timeit(lambda: self.streamer.demux(packets, ntrans, idxs), self.repeat)
+                results.append(self.result('streamer_demux', {'nsamp' : nsamp, 'nt' : nt, 'ntone' : len(ntrans)}, stats))
+
+        # Back to the defaults.
+        recv.source = source
+        self.streamer.set(10000)
+        return results
+
+    def bench_get_xs(self):
+        results = []
+        for n in self.ntones(self.nch):
+            self.set_tones(self.random_tones(n))
+            self.chain.enable_channels()
+            for mean in [False, True]:
+                stats = timeit(lambda: self.chain.get_xs(mean=mean), self.repeat)
+                results.append(self.result('get_xs', {'ntone' : n, 'mean' : mean}, stats))
+        return results
+
+    def bench_phase_fit(self):
+        results = []
+        for n in self.NPOINTS:
+            # Wrapped phase of a 10 us delay over the band.
+            f = np.linspace(0, self.chain.analysis.fs/2, n)
+            phi = np.angle(np.exp(2j*np.pi*f*10)) + 0.01*self.rng.standard_normal(n)
+            stats = timeit(lambda: self.chain.phase_fit(f, phi), self.repeat)
+            results.append(self.result('phase_fit', {'npoints' : n}, stats))
+        return results
+
+    def bench_apply_calibration(self, nf=10, nseg=100):
+        # Legacy Scan, loaded by path: mkids_v2/soft has a Scan module of its own.
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), LEGACY_SCAN)
+        spec = importlib.util.spec_from_file_location('legacy_scan', path)
+        legacy = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(legacy)
+
+        class FirstNyquistZone():
+            def fAliasedFromFTone(self, f):
+                return f
+
+        scan = legacy.Scan(FirstNyquistZone())
+        fMin, fMax = 100., 1100.
+
+        # Calibration in the format of makeCalibration.
+        fList = np.linspace(fMin, fMax, nseg+1)
+        sFreqs = np.linspace(fMin, fMax, 100*nseg)
+        sxs = (1 + 0.1*np.sin(sFreqs))*np.exp(1j*0.01*sFreqs)
+        cInterps = []
+        for f0, f1 in zip(fList[:-1], fList[1:]):
+            inds = (f0 <= sFreqs) & (sFreqs <= f1)
+            cInterps.append(interp1d(sFreqs[inds], sxs[inds], bounds_error=False, fill_value="extrapolate"))
+        calibration = {'fList' : fList, 'cInterps' : cInterps, 'nominalDelay' : 0}
+
+        results = []
+        for n in [10, 100, 1000]:
+            fscan = {'freqs' : self.rng.uniform(fMin+1, fMax-1, n),
+                     'dfs'   : np.linspace(-0.5, 0.5, nf),
+                     'xs'    : self.rng.standard_normal((nf, n)) + 1j*self.rng.standard_normal((nf, n))}
+            stats = timeit(lambda: scan.applyCalibration(fscan, calibration), self.repeat)
+            results.append(self.result('apply_calibration', {'ntone' : n, 'nf' : nf}, stats))
+        return results
+
+    def run(self, select=None):
+        """
+        Run all the benchmarks, or those with select in their name.
+        """
+        results = []
+        for name in sorted(dir(self)):
+            if name.startswith('bench_') and (select is None or select in name):
+                results += getattr(self, name)()
+        return results
+
+    def meta(self):
+        return {'date'      : time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python'    : platform.python_version(),
+                'numpy'     : np.__version__,
+                'machine'   : platform.machine(),
+                'hwh'       : os.path.basename(self.hwhfile),
+                'board'     : self.soc['board'],
+                'latency'   : self.soc.dma_cfg['latency'],
+                'bandwidth' : self.soc.dma_cfg['bandwidth'],
+                'repeat'    : self.repeat}
+
+if __name__ == '__main__':
+    hwhfile = os.path.join(os.path.dirname(os.path.abspath(__file__)), HWH)
+    output = None
+    repeat = 10
+    latency = 0
+    bandwidth = None
+    select = None
+
+    options, remainder = getopt.gnu_getopt(sys.argv[1:], 'f:o:r:l:b:k:h')
+    for opt, arg in options:
+        if opt == '-f':
+            hwhfile = arg
+        elif opt == '-o':
+            output = arg
+        elif opt == '-r':
+            repeat = int(arg)
+        elif opt == '-l':
+            latency = float(arg)
+        elif opt == '-b':
+            bandwidth = float(arg)
+        elif opt == '-k':
+            select = arg
+        elif opt == '-h':
+            print("\nUsage: "+sys.argv[0]+" [options]")
+            print("Arguments: ")
+            print("\t-f: hwh file (default %s)" % HWH)
+            print("\t-o: JSON output file (default none)")
+            print("\t-r: runs per benchmark (default 10)")
+            print("\t-l: DMA latency in seconds (default 0)")
+            print("\t-b: DMA bandwidth in bytes/second (default no limit)")
+            print("\t-k: only run benchmarks with this in their name")
+            print("\t-h: this message")
+            print("\n")
+            sys.exit(0)
+
+    bench = Benchmarks(hwhfile, latency=latency, bandwidth=bandwidth, repeat=repeat)
+    results = bench.run(select)
+
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump({'meta' : bench.meta(), 'results' : results}, f, indent=2)
@@ -192,6 +192,9 @@ class AxisDdsV2(SocIp):
     # Phase.
     MIN_PHI     = 0
     MAX_PHI     = 360
+
+    # Skip the reset of all channels in the constructor: it is done on first use instead.
+    LAZY_RESET  = False
     
     def __init__(self, description):
         # Initialize ip
@@ -212,8 +215,9 @@ class AxisDdsV2(SocIp):
         self.NCH_TOTAL = self.L * self.NCH
 
         # Initialize DDSs.
-        for i in range(self.NCH_TOTAL):
-            self.ddscfg(ch = i)
+        self.reset_pending = True
+        if not self.LAZY_RESET:
+            self.bulk_off()
 
         # Start DDS.
         self.start()
@@ -230,6 +234,9 @@ class AxisDdsV2(SocIp):
     def ddscfg(self, f=0, fi=0, g=0, ch=0, sel="dds", verbose=False):
         # Sanity check.
         if verbose: print("dds.py AxisDdsV2 ddscfg:  f, fi, g, ch, sel=",f,fi,g,ch,sel)
+        if self.reset_pending:
+            self.bulk_off()
+
         if (ch >= 0 and ch < self.NCH_TOTAL):
             if (f >= -self.FS_DDS/2 and f < self.FS_DDS/2):
                 if (fi >= self.MIN_PHI and fi < self.MAX_PHI): 
@@ -265,9 +272,37 @@ class AxisDdsV2(SocIp):
         else:
             raise ValueError('ch=%d not contained in [%d,%d)'%(ch,0,self.NCH_TOTAL))
             
+    def off_registers(self):
+        # Register image of a channel that is off (ddscfg with the default arguments).
+        return {'addr_pinc_reg'  : 0,
+                'addr_phase_reg' : 0,
+                'addr_gain_reg'  : 0,
+                'addr_cfg_reg'   : 0}
+
+    def bulk_off(self, chs=None):
+        """
+        Switch channels off (all by default) without going through ddscfg().
+
+        The data registers are latched by the write enable, so the off image is written once
+        and then each channel only needs its number and a write-enable strobe.
+        """
+        if chs is None:
+            chs = np.arange(self.NCH_TOTAL)
+            self.reset_pending = False
+        chs = np.atleast_1d(chs).astype(int)
+        bad = (chs < 0) | (chs >= self.NCH_TOTAL)
+        if bad.any():
+            raise ValueError('ch=%d not contained in [%d,%d)'%(chs[bad][0],0,self.NCH_TOTAL))
+
+        for reg, val in self.off_registers().items():
+            setattr(self, reg, val)
+        for ch in chs.tolist():
+            self.addr_nchan_reg = ch
+            self.addr_we_reg    = 1
+            self.addr_we_reg    = 0
+
     def alloff(self):
-        for ch in np.arange(self.NCH_TOTAL):
-            self.ddscfg(g=0, ch=ch)            
+        self.bulk_off()
             
 class AxisDdsV3(SocIp):
     bindto = ['user.org:user:axis_dds_v3:1.0']
@@ -295,6 +330,9 @@ class AxisDdsV3(SocIp):
     # Phase.
     MIN_PHI     = 0
     MAX_PHI     = 360
+
+    # Skip the reset of all channels in the constructor: it is done on first use instead.
+    LAZY_RESET  = False
     
     def __init__(self, description):
         # Initialize ip
@@ -315,8 +353,9 @@ class AxisDdsV3(SocIp):
         self.NCH_TOTAL = self.L * self.NCH
 
         # Initialize DDSs.
-        for i in range(self.NCH_TOTAL):
-            self.ddscfg(ch = i)
+        self.reset_pending = True
+        if not self.LAZY_RESET:
+            self.bulk_off()
 
         # Start DDS.
         self.start()
@@ -332,6 +371,9 @@ class AxisDdsV3(SocIp):
 
     def ddscfg(self, f=0, fi=0, g=0, ch=0, sel="dds", verbose=False):
         if verbose: print("dds.py AxisDdsV3 ddscfg:  f, fi, g, ch, sel=",f,fi,g,ch,sel)
+        if self.reset_pending:
+            self.bulk_off()
+
         # Sanity check.
         if (ch >= 0 and ch < self.NCH_TOTAL):
             if (f >= -self.FS_DDS/2 and f < self.FS_DDS/2):
@@ -368,9 +410,37 @@ class AxisDdsV3(SocIp):
         else:
             raise ValueError('ch=%d not contained in [%d,%d)'%(ch,0,self.NCH_TOTAL))
             
+    def off_registers(self):
+        # Register image of a channel that is off (ddscfg with the default arguments).
+        return {'addr_pinc_reg'  : 0,
+                'addr_phase_reg' : 0,
+                'addr_gain_reg'  : 0,
+                'addr_cfg_reg'   : 0}
+
+    def bulk_off(self, chs=None):
+        """
+        Switch channels off (all by default) without going through ddscfg().
+
+        The data registers are latched by the write enable, so the off image is written once
+        and then each channel only needs its number and a write-enable strobe.
+        """
+        if chs is None:
+            chs = np.arange(self.NCH_TOTAL)
+            self.reset_pending = False
+        chs = np.atleast_1d(chs).astype(int)
+        bad = (chs < 0) | (chs >= self.NCH_TOTAL)
+        if bad.any():
+            raise ValueError('ch=%d not contained in [%d,%d)'%(chs[bad][0],0,self.NCH_TOTAL))
+
+        for reg, val in self.off_registers().items():
+            setattr(self, reg, val)
+        for ch in chs.tolist():
+            self.addr_nchan_reg = ch
+            self.addr_we_reg    = 1
+            self.addr_we_reg    = 0
+
     def alloff(self):
-        for ch in np.arange(self.NCH_TOTAL):
-            self.ddscfg(g=0, ch=ch)            
+        self.bulk_off()
 
 class AxisDdsDualV1(SocIp):
     bindto = ['user.org:user:axis_dds_dual_v1:1.0']
@@ -399,6 +469,9 @@ class AxisDdsDualV1(SocIp):
     # Phase.
     MIN_PHI     = 0
     MAX_PHI     = 360
+
+    # Skip the reset of all channels in the constructor: it is done on first use instead.
+    LAZY_RESET  = False
     
     def __init__(self, description):
         # Initialize ip
@@ -422,9 +495,14 @@ class AxisDdsDualV1(SocIp):
         self.NCH    = int(description['parameters']['NCH'])
         self.NCH_TOTAL = self.L * self.NCH
 
+        # Shadow of the last values written to each channel: pinc, phase, dds gain, comp gain, cfg.
+        self.shadow = np.zeros((self.NCH_TOTAL, 5), dtype=np.int64)
+        self.shadow_valid = np.zeros(self.NCH_TOTAL, dtype=bool)
+
         # Initialize DDSs.
-        for i in range(self.NCH_TOTAL):
-            self.ddscfg(ch = i)
+        self.reset_pending = True
+        if not self.LAZY_RESET:
+            self.bulk_off()
 
         # Start DDS.
         self.start()
@@ -444,6 +522,8 @@ class AxisDdsDualV1(SocIp):
 
     def ddscfg(self, f=0, fi=0, g=0, cg=0, ch=0, comp=False, verbose=False):
         if verbose: print("dds.py  AxisDdsDualV1 ddscfg:  f, fi, g, ch, comp=",f,fi,g,ch,comp)
+        if self.reset_pending:
+            self.bulk_off()
 
         # Real/Imaginary part of compensation gain.
         cg_i = np.real(cg)
@@ -496,6 +576,10 @@ class AxisDdsDualV1(SocIp):
                                 self.addr_cfg_reg       = cfg
                                 self.addr_we_reg    = 1
                                 self.addr_we_reg    = 0
+
+                                # Update shadow.
+                                self.shadow[ch] = [int(v) for v in (ki, fik, gi, cg_int, cfg)]
+                                self.shadow_valid[ch] = True
                     else:
                         raise ValueError('gain=%f not contained in [%f,%f)'%(g,self.MIN_GAIN,self.MAX_GAIN))
                 else:
@@ -505,7 +589,195 @@ class AxisDdsDualV1(SocIp):
         else:
             raise ValueError('ch=%d not contained in [%d,%d)'%(ch,0,self.NCH_TOTAL))
             
+    def ddscfg_many(self, chs, f=0, fi=0, g=0, cg=0, comp=False, force=False, verbose=False):
+        """
+        Same as ddscfg() for many channels at once.
+
+        All values are checked and quantized as arrays before anything is written, so an invalid
+        entry leaves the hardware untouched. Each channel still needs its own write-enable strobe:
+        registers are then written in a single loop over pre-computed integers. Channels whose
+        quantized values match the shadow of the last write are skipped.
+
+        Parameters:
+        -----------
+            chs: array of ints
+                channel numbers
+            f: float or array of floats (Default 0)
+                dds frequency (Hz)
+            fi: float or array of floats (Default 0)
+                phase (degrees)
+            g: float or array of floats (Default 0)
+                gain in [-1,1)
+            cg: complex or array of complex (Default 0)
+                compensation gain
+            comp: boolean or array of booleans (Default False)
+                apply compensation gain
+            force: boolean (Default False)
+                write all channels, even if unchanged
+
+        Returns:
+        --------
+            nwritten: int
+                number of channels actually written
+        """
+        if self.reset_pending:
+            self.bulk_off()
+
+        chs = np.atleast_1d(chs).astype(int)
+        f, fi, g, cg, comp = [np.broadcast_to(np.asarray(x), chs.shape) for x in (f, fi, g, cg, comp)]
+        if verbose: print("dds.py  AxisDdsDualV1 ddscfg_many:  %d channels" % len(chs))
+
+        # Real/Imaginary part of compensation gain.
+        cg_i = np.real(cg)
+        cg_q = np.imag(cg)
+
+        # Sanity check (same order as ddscfg, report the first offending value).
+        bad = (chs < 0) | (chs >= self.NCH_TOTAL)
+        if bad.any():
+            raise ValueError('ch=%d not contained in [%d,%d)'%(chs[bad][0],0,self.NCH_TOTAL))
+        bad = (f < -self.FS_DDS/2) | (f >= self.FS_DDS/2)
+        if bad.any():
+            raise ValueError('frequency=%f not contained in [%f,%f)'%(f[bad][0],0,self.FS_DDS))
+        bad = (fi < self.MIN_PHI) | (fi >= self.MAX_PHI)
+        if bad.any():
+            raise ValueError('phase=%f not contained in [%f,%f)'%(fi[bad][0],self.MIN_PHI,self.MAX_PHI))
+        for x in (g, cg_i, cg_q):
+            bad = (x < self.MIN_GAIN) | (x >= self.MAX_GAIN)
+            if bad.any():
+                raise ValueError('gain=%f not contained in [%f,%f)'%(x[bad][0],self.MIN_GAIN,self.MAX_GAIN))
+
+        # Quantize.
+        ki = np.round(f/self.DF_DDS).astype(np.int64)
+        fik = np.round(fi/self.DFI_DDS).astype(np.int64)
+        gi = (g*(2**(self.B_GAIN-1))).astype(np.int64)
+        cg_int = (cg_i*(2**(self.B_GAIN-1)) + (2**self.B_GAIN)*cg_q*(2**(self.B_GAIN-1))).astype(np.int64)
+
+        # Output selection.
+        cfg = {"product" : 0, "dds" : 1, "input" : 2}.get(self.sel_default, 3)
+
+        # Compensation.
+        cfg = cfg + 4*np.logical_not(comp)
+
+        # Skip channels already holding these values.
+        vals = np.stack([ki, fik, gi, cg_int, cfg], axis=1)
+        if not force:
+            changed = ~(self.shadow_valid[chs] & (self.shadow[chs] == vals).all(axis=1))
+            chs = chs[changed]
+            vals = vals[changed]
+
+        # Write values to hardware.
+        for ch_, (ki_, fik_, gi_, cg_, cfg_) in zip(chs.tolist(), vals.tolist()):
+            self.addr_nchan_reg     = ch_
+            self.addr_pinc_reg      = ki_
+            self.addr_phase_reg     = fik_
+            self.addr_dds_gain_reg  = gi_
+            self.addr_comp_gain_reg = cg_
+            self.addr_cfg_reg       = cfg_
+            self.addr_we_reg    = 1
+            self.addr_we_reg    = 0
+
+        # Update shadow.
+        self.shadow[chs] = vals
+        self.shadow_valid[chs] = True
+
+        return len(chs)
+
+    def set_tones(self, chs, f=0, fi=0, g=0, cg=0, comp=False, verbose=False):
+        """
+        Program the given channels and switch off all the others.
+
+        Only differences with the shadow registers are written: channels that keep their values
+        are not touched, channels that were on and are now off get a single zeroing write.
+        Same parameters as ddscfg_many().
+
+        Returns:
+        --------
+            nwritten: int
+                number of channels actually written
+        """
+        chs = np.atleast_1d(chs).astype(int)
+        f, fi, g, cg, comp = [np.broadcast_to(np.asarray(x), chs.shape) for x in (f, fi, g, cg, comp)]
+
+        # Sanity check.
+        bad = (chs < 0) | (chs >= self.NCH_TOTAL)
+        if bad.any():
+            raise ValueError('ch=%d not contained in [%d,%d)'%(chs[bad][0],0,self.NCH_TOTAL))
+
+        # Full table: all channels off, then the requested ones.
+        all_f = np.zeros(self.NCH_TOTAL)
+        all_fi = np.zeros(self.NCH_TOTAL)
+        all_g = np.zeros(self.NCH_TOTAL)
+        all_cg = np.zeros(self.NCH_TOTAL, dtype=complex)
+        all_comp = np.zeros(self.NCH_TOTAL, dtype=bool)
+        all_f[chs] = f
+        all_fi[chs] = fi
+        all_g[chs] = g
+        all_cg[chs] = cg
+        all_comp[chs] = comp
+
+        return self.ddscfg_many(np.arange(self.NCH_TOTAL), f=all_f, fi=all_fi, g=all_g, cg=all_cg, comp=all_comp, verbose=verbose)
+            
+    def off_registers(self):
+        # Register image of a channel that is off (ddscfg with the default arguments).
+        cfg = {"product" : 0, "dds" : 1, "input" : 2}.get(self.sel_default, 3) + 4
+        return {'addr_pinc_reg'      : 0,
+                'addr_phase_reg'     : 0,
+                'addr_dds_gain_reg'  : 0,
+                'addr_comp_gain_reg' : 0,
+                'addr_cfg_reg'       : cfg}
+
+    def bulk_off(self, chs=None, force=True):
+        """
+        Switch channels off (all by default) without going through ddscfg().
+
+        The data registers are latched by the write enable, so the off image is written once
+        and then each channel only needs its number and a write-enable strobe.
+
+        Parameters:
+        -----------
+            chs: array of ints or None (Default None)
+                channel numbers, None for all
+            force: boolean (Default True)
+                write all channels, even if the shadow says they are already off
+
+        Returns:
+        --------
+            nwritten: int
+                number of channels actually written
+        """
+        if chs is None:
+            chs = np.arange(self.NCH_TOTAL)
+            self.reset_pending = False
+        chs = np.atleast_1d(chs).astype(int)
+        bad = (chs < 0) | (chs >= self.NCH_TOTAL)
+        if bad.any():
+            raise ValueError('ch=%d not contained in [%d,%d)'%(chs[bad][0],0,self.NCH_TOTAL))
+
+        regs = self.off_registers()
+        vals = np.array([regs['addr_pinc_reg'], regs['addr_phase_reg'], regs['addr_dds_gain_reg'],
+                         regs['addr_comp_gain_reg'], regs['addr_cfg_reg']], dtype=np.int64)
+
+        # Skip channels already off.
+        if not force:
+            chs = chs[~(self.shadow_valid[chs] & (self.shadow[chs] == vals).all(axis=1))]
+        if len(chs) == 0:
+            return 0
+
+        for reg, val in regs.items():
+            setattr(self, reg, val)
+        for ch in chs.tolist():
+            self.addr_nchan_reg = ch
+            self.addr_we_reg    = 1
+            self.addr_we_reg    = 0
+
+        # Update shadow.
+        self.shadow[chs] = vals
+        self.shadow_valid[chs] = True
+
+        return len(chs)
+
     def alloff(self):
-        for ch in np.arange(self.NCH_TOTAL):
-            self.ddscfg(ch=ch) # WIll zero-out output and down-convert with 0 freq.
+        # WIll zero-out output and down-convert with 0 freq.
+        # Channels already off are skipped, unless the initial reset is still pending.
+        self.bulk_off(force=self.reset_pending)
 
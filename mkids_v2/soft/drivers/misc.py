@@ -1,3 +1,4 @@
+import asyncio
 import numpy as np
 from pynq.buffer import allocate
 from qick.qick import SocIp
@@ -117,6 +118,56 @@ class AxisChSelPfbV2(SocIp):
                 self.we_reg = 1
                 self.we_reg = 0
             
+    def set_mask(self, chs, verbose=False):
+        """
+        Enable exactly the transactions holding the given channels, masking all the others.
+
+        The full mask is computed at once and only the mask words that changed are written.
+
+        Parameters:
+        -----------
+            chs: array of ints
+                channels to enable
+            verbose: boolean (Default False)
+                talk to me!
+
+        Returns:
+        --------
+            ntrans: ndarray of ints
+                transaction number of each channel
+            idxs: ndarray of ints
+                index of each channel within its transaction
+        """
+        chs = np.atleast_1d(chs).astype(int)
+
+        # Sanity check.
+        if len(chs) > 0 and (chs.min() < 0 or chs.max() >= self.NCH):
+            raise ValueError("%s: channel must be within [0,%d]" %(self.fullpath, self.NCH-1))
+
+        # Transaction number and bit index.
+        ntrans, addrs, bits = self.ch2tran(chs)
+        trans = np.unique(ntrans)
+
+        # Data Mask.
+        mask = np.zeros(self.NM, dtype=np.int64)
+        np.bitwise_or.at(mask, trans//32, np.left_shift(1, trans%32))
+
+        # Write changed words only.
+        for addr in np.nonzero(mask != np.array(self.dict['addr'], dtype=np.int64))[0]:
+            if verbose:
+                print("{}: addr = {}, Original Mask: {}, Updated Mask: {}".format(self.fullpath, addr, self.dict['addr'][addr], mask[addr]))
+            self.addr_reg = int(addr)
+            self.data_reg = int(mask[addr])
+            self.we_reg = 1
+            self.we_reg = 0
+
+        # Update dictionary.
+        self.dict['addr'] = mask.tolist()
+        self.dict['tran'] = trans
+        self.dict['chan'] = (trans[:,None]*self.L + np.arange(self.L)).reshape(-1)
+
+        return ntrans, self.ch2idx(chs)
+
     def set_single(self,ch):
         self.alloff()
         self.set(ch)
@@ -240,6 +291,55 @@ class AxisChSelPfbV3(SocIp):
                 self.stop()
                 self.start()
             
+    def set_mask(self, chs, verbose=False):
+        """
+        Enable exactly the transactions holding the given channels, masking all the others.
+
+        The full mask is built at once and compared with the current one: the punct register is only
+        written when they differ.
+
+        Parameters:
+        -----------
+            chs: array of ints
+                channels to enable
+            verbose: boolean (Default False)
+                talk to me!
+
+        Returns:
+        --------
+            ntrans: ndarray of ints
+                transaction number of each channel
+            idxs: ndarray of ints
+                index of each channel within its transaction
+        """
+        chs = np.atleast_1d(chs).astype(int)
+
+        # Sanity check.
+        if len(chs) > 0 and (chs.min() < 0 or chs.max() >= self.NCH):
+            raise ValueError("%s: channel must be within [0,%d]" %(self.fullpath, self.NCH-1))
+
+        # Transaction number and bit index.
+        ntrans, addrs, bits = self.ch2tran(chs)
+        trans = np.unique(ntrans)
+
+        # Data Mask.
+        data = int(np.bitwise_or.reduce(np.left_shift(1, trans%32), initial=0))
+
+        # Write Value.
+        if data != self.dict['punct']:
+            if verbose:
+                print("{}: Original Mask: {}, Updated Mask: {}".format(self.fullpath, self.dict['punct'], data))
+            self.punct_reg = data
+            self.stop()
+            self.start()
+
+        # Update dictionary.
+        self.dict['punct'] = data
+        self.dict['tran']  = trans
+        self.dict['chan']  = (trans[:,None]*self.L + np.arange(self.L)).reshape(-1)
+
+        return ntrans, self.ch2idx(chs)
+
     def set_single(self,ch):
         self.alloff()
         self.set(ch)
@@ -271,6 +371,7 @@ class AxisStreamerV1(SocIp):
     # NSAMP_REG : number of samples per transaction (for TLAST generation).
     bindto = ['user.org:user:axis_streamer_v1:1.0']
     REGISTERS = {'start_reg' : 0, 'nsamp_reg' : 1}
+    DTYPE = np.int16
     
     def __init__(self, description):
         # Initialize ip
@@ -296,6 +397,16 @@ class AxisStreamerV1(SocIp):
         
         # Number of total samples per transaction.
         self.NS_NI = self.NS + self.NI
+
+        # DMA buffer allocator (the simulated backend replaces it).
+        self.allocate = allocate
+
+        # Pool of DMA buffers (ping-pong/ring).
+        self.buffs = []
+        self.buff = None
+
+        # Demultiplexer tables for the last tone configuration.
+        self.demux_cfg = {'key' : None}
         
     def configure(self,axi_dma):
         self.dma = axi_dma
@@ -306,11 +417,20 @@ class AxisStreamerV1(SocIp):
     def start(self):
         self.start_reg = 1
 
-    def set(self, nsamp=100):
+    def set(self, nsamp=100, nbuf=2):
         # Configure parameters.
         self.nsamp_reg  = nsamp
-        nbuf = nsamp*self.NS_TR
-        self.buff = allocate(shape=(nbuf,), dtype=np.int16)
+        nlen = nsamp*self.NS_TR
+
+        # Buffer pool: with nbuf >= 2 the next DMA transfer runs while the previous one is decoded.
+        # DMA-able memory is limited, so only re-allocate when the shape changes.
+        if nbuf < 1:
+            raise ValueError("%s: number of buffers must be at least 1" % self.fullpath)
+        if len(self.buffs) != nbuf or len(self.buffs[0]) != nlen:
+            for buff in self.buffs:
+                buff.freebuffer()
+            self.buffs = [self.allocate(shape=(nlen,), dtype=self.DTYPE) for i in range(nbuf)]
+        self.buff = self.buffs[0]
         
         # Update register value.
         self.stop()
@@ -323,23 +443,65 @@ class AxisStreamerV1(SocIp):
         
         return self.buff
 
+    def packets(self, buff):
+        # Data format:
+        # Each streamer transaction is 512 bits. It contains 8 samples (32-bit each) plus 1 sample (16-bit) for TUSER.
+        # The upper 15 samples are filled with zeros.
+        # Returns a view on the buffer (no copy).
+        return buff.reshape((self.nsamp_reg, -1))[:,:self.NS_NI]
+
+    def transfer_iter(self, nt=1):
+        """
+        Generator over nt DMA transfers using the buffer pool.
+
+        With nbuf >= 2, transfer k+1 is armed on the DMA before transfer k is handed back, so
+        decoding overlaps with the DMA. Each item is a (nsamp, NS_NI) int16 view on a DMA buffer:
+        it is only valid until the same buffer is re-armed, i.e. for len(self.buffs)-1 further
+        iterations. Copy it if it needs to live longer. With a single buffer the next transfer is
+        armed when the generator resumes, so there is no overlap. With nt=None transfers go on
+        until the generator is closed.
+        """
+        nbuf = len(self.buffs)
+
+        # Arm first transfer.
+        self.dma.recvchannel.transfer(self.buffs[0])
+        armed = True
+
+        i = 0
+        try:
+            while nt is None or i < nt:
+                buff = self.buffs[i % nbuf]
+                self.dma.recvchannel.wait()
+                armed = False
+
+                # Arm next transfer before handing back this one, unless it goes to the same buffer.
+                more = nt is None or i+1 < nt
+                if more and nbuf > 1:
+                    self.dma.recvchannel.transfer(self.buffs[(i+1) % nbuf])
+                    armed = True
+
+                yield self.packets(buff)
+
+                # Single buffer: the consumer is done with it.
+                if more and nbuf == 1:
+                    self.dma.recvchannel.transfer(buff)
+                    armed = True
+                i += 1
+        finally:
+            # Generator closed early: let the armed transfer finish so the channel is idle again.
+            if armed:
+                self.dma.recvchannel.wait()
+
     def transfer(self,nt=1):
         # Data structure:
         # First dimention: number of dma transfers.
         # Second dimension: number of streamer transactions.
         # Third dimension: Number of I + Number of Q + Index (17 samples, 16-bit each).
-        data = np.zeros((nt,self.nsamp_reg,self.NS_NI))
+        data = np.zeros((nt,self.nsamp_reg,self.NS_NI), dtype=self.DTYPE)
         
-        for i in np.arange(nt):
-        
-            # DMA data.
-            self.dma.recvchannel.transfer(self.buff)
-            self.dma.recvchannel.wait()
-                
-            # Data format:
-            # Each streamer transaction is 512 bits. It contains 8 samples (32-bit each) plus 1 sample (16-bit) for TUSER.
-            # The upper 15 samples are filled with zeros.        
-            data[i,:,:] = self.buff.reshape((self.nsamp_reg, -1))[:,:self.NS_NI]
+        # Copy of transfer i overlaps with DMA of transfer i+1.
+        for i, packets in enumerate(self.transfer_iter(nt)):
+            data[i,:,:] = packets
             
         return data
     
@@ -353,9 +515,9 @@ class AxisStreamerV1(SocIp):
         # Number of samples per transfer.
         ns = len(packets[0])
         
-        # Format data.
+        # Format data: packets stay int16, only the selected channel is converted.
         data_iq = packets[:,:,:16].reshape((-1,16)).T
-        xi,xq = data_iq[2*idx:2*idx+2]        
+        xi,xq = data_iq[2*idx:2*idx+2].astype(np.float32)
                 
         return [xi,xq]
 
@@ -366,20 +528,240 @@ class AxisStreamerV1(SocIp):
         # Format data.
         data = {'raw' : [], 'idx' : [], 'samples' : {}}
 
-        # Raw packets.
+        # Raw packets (int16, as received).
         data['raw'] = packets[:,:,:self.NS].reshape((-1,self.NS)).T
 
         # Active transactions.
         data['idx']     = packets[:,:,-1].reshape(-1).astype(int)
 
-        # Group samples per transaction index.
-        unique_idx = np.unique(data['idx'])
-        for i in unique_idx:
-            idx = np.argwhere(data['idx'] == i).reshape(-1)
-            data['samples'][i] = data['raw'][:,idx]
+        # Group samples per transaction index (one stable sort instead of a scan per index).
+        order = np.argsort(data['idx'], kind='stable')
+        unique_idx, starts = np.unique(data['idx'][order], return_index=True)
+        for i, group in zip(unique_idx, np.split(order, starts[1:])):
+            data['samples'][i] = data['raw'][:,group]
 
         return data
 
+    def demux_tables(self, ntrans, idxs):
+        # Tables only depend on the tone -> (transaction, index) map: cache them for the last map.
+        ntrans = np.asarray(ntrans, dtype=int).reshape(-1)
+        idxs = np.asarray(idxs, dtype=int).reshape(-1)
+        key = (ntrans.tobytes(), idxs.tobytes())
+        if self.demux_cfg['key'] != key:
+            self.demux_cfg = {  'key'     : key,
+                                'ntrans'  : ntrans,
+                                'ci'      : 2*idxs[:,None],
+                                'cq'      : 2*idxs[:,None]+1,
+                                'nbins'   : ntrans.max()+1 if len(ntrans) > 0 else 0}
+        return self.demux_cfg
+
+    def demux(self, packets, ntrans, idxs, nPreTruncate=0):
+        """
+        Demultiplex packets into one dense complex array for all tones at once.
+
+        Parameters:
+        -----------
+            packets: ndarray
+                packets returned by transfer(), shape (nt, nsamp, NS_NI)
+            ntrans: ndarray of ints
+                transaction number of each tone
+            idxs: ndarray of ints
+                index of each tone within its transaction
+            nPreTruncate: int (Default 0)
+                number of samples to ignore at beginning of stream
+
+        Returns:
+        --------
+            xs: ndarray of complex64, shape (ntone, nsamp)
+                All tones are truncated to the length of the least populated transaction.
+        """
+        cfg = self.demux_tables(ntrans, idxs)
+        ntrans = cfg['ntrans']
+
+        # Flat view: one row per streamer transaction.
+        flat = packets.reshape((-1, packets.shape[-1]))
+        order, counts, starts = self.demux_sort(flat, cfg)
+
+        # Rows of every tone, in time order.
+        ns = counts[ntrans].min() if len(ntrans) > 0 else 0
+        rows = order[starts[ntrans][:,None] + np.arange(nPreTruncate, max(ns, nPreTruncate))]
+
+        xs = np.empty(rows.shape, dtype=np.complex64)
+        xs.real = flat[rows, cfg['ci']]
+        xs.imag = flat[rows, cfg['cq']]
+
+        return xs
+
+    def demux_sort(self, flat, cfg):
+        # Stable sort on 16-bit keys is a radix sort: O(n) instead of one scan per transaction.
+        idx = flat[:,-1].astype(np.int16, copy=False)
+        order = np.argsort(idx, kind='stable')
+        counts = np.bincount(idx, minlength=cfg['nbins'])
+        starts = np.cumsum(counts) - counts
+
+        return order, counts, starts
+
+    def demux_all(self, packets, ntrans, idxs):
+        """
+        Same as demux() but keeps every sample: tones are zero-padded to the longest one.
+
+        Returns:
+        --------
+            xs: ndarray of complex64, shape (ntone, nmax)
+            lengths: ndarray of ints, number of valid samples of each tone
+        """
+        cfg = self.demux_tables(ntrans, idxs)
+        ntrans = cfg['ntrans']
+
+        flat = packets.reshape((-1, packets.shape[-1]))
+        order, counts, starts = self.demux_sort(flat, cfg)
+
+        lengths = counts[ntrans]
+        nmax = lengths.max() if len(ntrans) > 0 else 0
+        pos = starts[ntrans][:,None] + np.arange(nmax)
+        rows = order[np.minimum(pos, len(order)-1)]
+
+        xs = np.empty(rows.shape, dtype=np.complex64)
+        xs.real = flat[rows, cfg['ci']]
+        xs.imag = flat[rows, cfg['cq']]
+        xs[np.arange(nmax) >= lengths[:,None]] = 0
+
+        return xs, lengths
+
+    def reduce(self, ntrans, idxs, reducers, nt=1, nPreTruncate=0):
+        """
+        Feed nt DMA transfers to a list of per-tone reducers (see reducers.py).
+
+        Transfers are demultiplexed one at a time straight from the int16 DMA buffers:
+        the (nt, nsamp, NS_NI) packet array and per-tone sample arrays are never built.
+
+        Parameters:
+        -----------
+            ntrans: ndarray of ints
+                transaction number of each tone
+            idxs: ndarray of ints
+                index of each tone within its transaction
+            reducers: list
+                reducer objects, with reset(ntone), update(xs, lengths) and result()
+            nt: int (Default 1)
+                number of dma transfers
+            nPreTruncate: int (Default 0)
+                number of samples to ignore at beginning of stream
+
+        Returns:
+        --------
+            results: list with the result() of each reducer
+        """
+        cfg = self.demux_tables(ntrans, idxs)
+        for r in reducers:
+            r.reset(len(cfg['ntrans']))
+
+        skip = nPreTruncate
+        for packets in self.transfer_iter(nt):
+            xs, lengths = self.demux_all(packets, ntrans, idxs)
+
+            # Drop first samples of the stream.
+            if skip > 0:
+                k = min(skip, xs.shape[1])
+                xs = xs[:,k:]
+                lengths = np.maximum(lengths-k, 0)
+                skip -= k
+
+            for r in reducers:
+                r.update(xs, lengths)
+
+        return [r.result() for r in reducers]
+
+    def sequence_breaks(self, idx, trans, prev=None):
+        """
+        Count breaks in the transaction-index sequence.
+
+        The streamer cycles through the enabled transactions (trans, sorted) in order, so each
+        index must be followed by the next enabled one. prev is the last index seen before idx
+        (previous transfer), to also check continuity across transfers. Gaps of whole cycles
+        cannot be detected.
+        """
+        idx = np.asarray(idx).astype(int)
+        if prev is not None:
+            idx = np.concatenate(([int(prev)], idx))
+        pos = np.searchsorted(trans, idx)
+        pos[pos >= len(trans)] = 0
+        return int(np.count_nonzero((pos[:-1]+1) % len(trans) != pos[1:]))
+
+    def stream(self, ntrans, idxs, blocksize=10000, nblocks=None, verbose=False):
+        """
+        Generator of fixed-size per-tone blocks from back-to-back DMA transfers.
+
+        Memory is bounded: samples are kept in a (ntone, blocksize + 2*nsamp) carry buffer
+        between transfers. Closing the generator stops the transfers.
+
+        Parameters:
+        -----------
+            ntrans: ndarray of ints
+                transaction number of each tone
+            idxs: ndarray of ints
+                index of each tone within its transaction
+            blocksize: int (Default 10000)
+                number of samples per tone in each block
+            nblocks: int (Default None)
+                number of blocks to produce, None to go on until the generator is closed
+
+        Yields:
+        -------
+            block: dict
+                'xs'      : ndarray of complex64, shape (ntone, blocksize)
+                'block'   : block number
+                'dropped' : breaks found in the transaction-index sequence since previous block
+        """
+        cfg = self.demux_tables(ntrans, idxs)
+        ntone = len(cfg['ntrans'])
+        trans = np.unique(cfg['ntrans'])
+
+        # Carry buffer and number of valid samples per tone.
+        cap = blocksize + 2*self.nsamp_reg
+        carry = np.zeros((ntone, cap), dtype=np.complex64)
+        fill = np.zeros(ntone, dtype=int)
+        tones = np.arange(ntone)[:,None]
+
+        prev = None
+        dropped = 0
+        iblock = 0
+
+        # Make sure the streamer is running.
+        self.start()
+
+        for packets in self.transfer_iter(nt=None):
+            # Check sequence (within this transfer and against the previous one).
+            idx = packets[:,-1]
+            nbreaks = self.sequence_breaks(idx, trans, prev)
+            prev = idx[-1]
+            if nbreaks > 0:
+                dropped += nbreaks
+                if verbose:
+                    print("{}: {} breaks in transaction sequence before block {}".format(self.fullpath, nbreaks, iblock))
+
+            # Append new samples to the carry buffer.
+            xs, lengths = self.demux_all(packets, ntrans, idxs)
+            if (fill + lengths).max() > cap:
+                # Tones went out of step (overrun): restart blocks from here.
+                fill[:] = 0
+                dropped += 1
+            cols = fill[:,None] + np.arange(xs.shape[1])
+            valid = np.arange(xs.shape[1]) < lengths[:,None]
+            carry[np.broadcast_to(tones, cols.shape)[valid], cols[valid]] = xs[valid]
+            fill += lengths
+
+            # Hand back complete blocks.
+            while fill.min() >= blocksize:
+                yield {'xs' : carry[:,:blocksize].copy(), 'block' : iblock, 'dropped' : dropped}
+                carry[:,:-blocksize] = carry[:,blocksize:]
+                fill -= blocksize
+                dropped = 0
+                iblock += 1
+
+                if nblocks is not None and iblock >= nblocks:
+                    return
+
 
     def format_data(self, data):
         unique_idx = np.unique(data['idx'])
@@ -390,16 +772,40 @@ class AxisStreamerV1(SocIp):
 
         return samples
 
-    async def transfer_async(self):
-        # DMA data.
-        self.dma.recvchannel.transfer(self.buff)
-        await self.dma.recvchannel.wait_async()
-
-        # Format data.
-        data = self.buff & 0xFFFFF;
-        indx = (self.buff >> 24) & 0xFF;
+    async def transfer_async(self,nt=1):
+        # Same as transfer(), but waiting for the DMA does not block the event loop.
+        # Uses the buffer pool: with nbuf >= 2 the copy of transfer i overlaps with DMA of transfer i+1.
+        data = np.zeros((nt,self.nsamp_reg,self.NS_NI), dtype=self.DTYPE)
+        nbuf = len(self.buffs)
+
+        # Arm first transfer.
+        self.dma.recvchannel.transfer(self.buffs[0])
+        armed = True
+
+        try:
+            for i in range(nt):
+                buff = self.buffs[i % nbuf]
+                await self.dma.recvchannel.wait_async()
+                armed = False
+
+                # Arm next transfer before copying this one, unless it goes to the same buffer.
+                if i+1 < nt and nbuf > 1:
+                    self.dma.recvchannel.transfer(self.buffs[(i+1) % nbuf])
+                    armed = True
+
+                data[i,:,:] = self.packets(buff)
+
+                # Single buffer: copied, it can be re-armed.
+                if i+1 < nt and nbuf == 1:
+                    self.dma.recvchannel.transfer(buff)
+                    armed = True
+        finally:
+            # Cancelled: let the armed transfer finish so the channel is idle again.
+            # Shielded, so the wait is not cancelled too, and awaited, so the event loop is not blocked.
+            if armed:
+                await asyncio.shield(self.dma.recvchannel.wait_async())
 
-        return [indx,data]
+        return data
 
 class AxisKidsimV3(SocIp):
     bindto = ['user.org:user:axis_kidsim_v3:1.0']
@@ -591,6 +997,95 @@ class AxisKidsimV3(SocIp):
             addr_reg     )                        
         
 
+    def set_resonators(self, table, verbose = False):
+        """
+        Configure many resonators at once.
+
+        Same defaults and quantization as set_resonator(), computed on whole arrays. Registers are
+        then written in a single loop. Each lane holds one resonator: if several entries use the
+        same lane, the last one is kept.
+
+        Parameters:
+        -----------
+            table: dict of arrays (or scalars, broadcast to all resonators)
+                'channel' : PFB channel (required)
+                'dds_freq', 'sweep_freq', 'sweep_time', 'iir_c0', 'iir_c1', 'dds_wait', 'sel' :
+                    as in set_resonator_config()
+
+        Returns:
+        --------
+            regs: dict of arrays with the register values written, plus 'lane', 'punct_id' and
+                the (possibly updated) 'sweep_time'
+        """
+        ch = np.atleast_1d(table['channel']).astype(int)
+        n = len(ch)
+        def col(key, default):
+            return np.broadcast_to(np.asarray(table.get(key, default)), (n,))
+
+        sweep_freq = col('sweep_freq', 0.9).astype(float)
+        sweep_time = col('sweep_time', 100).astype(float)
+        iir_c0     = col('iir_c0', 0.99).astype(float)
+        iir_c1     = col('iir_c1', 0.8).astype(float)
+        dds_freq   = col('dds_freq', 0).astype(float)
+        dds_wait   = col('dds_wait', 1).astype(int)
+        sel        = col('sel', 'resonator')
+
+        # Gain.
+        iir_g = (1+iir_c1)/(1+iir_c0)
+
+        # Lane number and KIDSIM puncuring index.
+        lane = np.mod(ch, self.L)
+        punct_id = ch//self.L
+
+        # Sampling frequency of DDSs.
+        fs = self.FS_DDS/1e6
+        ts = 1/fs
+
+        # Number of steps.
+        nstep = np.floor(sweep_time/((dds_wait+1)*ts)).astype(np.int64)
+        if np.any(nstep < 1):
+            raise ValueError("%s: sweep_time shorter than one dds step for %d resonators" % (self.fullpath, np.sum(nstep < 1)))
+
+        # Sanity check (slope = 0).
+        bval = np.round(sweep_freq*1e6/self.DF_DDS).astype(np.int64)
+        slope = np.round(bval/nstep).astype(np.int64)
+        low = slope < 1
+        if low.any():
+            slope[low] = 1
+            nstep[low] = bval[low]
+            sweep_time[low] = nstep[low]*((dds_wait[low]+1)*ts)
+            print('{}: Updated sweep_time of {} resonators. Try increasing dds_wait.'
+                  .format(self.__class__.__name__, low.sum()))
+
+        # Register values.
+        regs = {}
+        regs['dds_bval_reg']  = bval
+        regs['dds_slope_reg'] = slope
+        regs['dds_steps_reg'] = nstep
+        regs['dds_wait_reg']  = dds_wait
+        regs['dds_freq_reg']  = np.round(dds_freq*1e6/self.DF_DDS).astype(np.int64)
+        regs['iir_c0_reg']    = np.round(iir_c0*(2**(self.B_COEF-1))).astype(np.int64)
+        regs['iir_c1_reg']    = np.round(iir_c1*(2**(self.B_COEF-1))).astype(np.int64)
+        regs['iir_g_reg']     = np.round(iir_g*(2**(self.B_COEF-1))).astype(np.int64)
+        regs['outsel_reg']    = np.select([sel == "resonator", sel == "dds", sel == "input"], [0, 1, 2], 3)
+        regs['punct_id_reg']  = punct_id
+        regs['addr_reg']      = lane
+
+        if verbose:
+            print('{}: {} resonators'.format(self.__class__.__name__, n))
+
+        # Set Registers.
+        keys = ['dds_bval_reg', 'dds_slope_reg', 'dds_steps_reg', 'dds_wait_reg', 'dds_freq_reg',
+                'iir_c0_reg', 'iir_c1_reg', 'iir_g_reg', 'outsel_reg', 'punct_id_reg', 'addr_reg']
+        for row in zip(*[regs[k].tolist() for k in keys]):
+            self.set_registers(*row)
+
+        regs['lane'] = lane
+        regs['punct_id'] = punct_id
+        regs['sweep_time'] = sweep_time
+
+        return regs
+
     def setall(self, config, verbose = False):
         # Build configuration dictionary.
         self.set_resonator_config(config)
@@ -0,0 +1,328 @@
+"""
+Batched resonator fits of frequency sweeps.
+
+All functions work on the (nf, ntone) arrays returned by KidsChain.sweep_tones(): the first index
+is the frequency point, the second one the tone. Every tone is fitted at the same time, with
+array operations over tones instead of a loop.
+
+Model (notch type resonator):
+
+    S21(f) = a exp(i alpha) exp(2 pi i f tau) [1 - (Qr/Qc) exp(i phi) / (1 + 2 i Qr (f/f0 - 1))]
+
+Frequencies are in MHz, so the delay tau is in us: the phase of the cable delay is 2 pi f tau,
+with the same sign as the DT of KidsChain.phase_correction(). A slope from KidsChain.phase_fit()
+is converted with tau = slope/(2 pi).
+"""
+import numpy as np
+
+
+def estimate_delay(f, xs, edge=0.1, niter=20):
+    """
+    Cable delay of each tone.
+
+    First from a line fit to the unwrapped phase at both ends of the sweep. The tails of the
+    resonance bias this slope, so it is then refined by a golden-section search (all tones at once)
+    for the delay that makes the points closest to a circle, within half a phase turn over the sweep.
+
+    Parameters:
+    -----------
+        f: ndarray of doubles, shape (nf, ntone)
+            frequencies (MHz)
+        xs: ndarray of complex, shape (nf, ntone)
+            measured S21
+        edge: double (Default 0.1)
+            fraction of points used at each end, away from the resonance
+        niter: int (Default 20)
+            golden-section iterations (0 for the line fit only)
+
+    Returns:
+    --------
+        tau: ndarray of doubles, one delay per tone (us)
+    """
+    nf = xs.shape[0]
+    ne = max(int(edge*nf), 2)
+    sel = np.zeros(nf, dtype=bool)
+    sel[:ne] = True
+    sel[-ne:] = True
+
+    # The resonance adds 2 pi (or nothing) to the phase across the sweep: remove the integer
+    # number of turns between the two ends before the fit.
+    phi = np.unwrap(np.angle(xs), axis=0)
+    x = f[sel]
+    y = phi[sel]
+    x = x - x.mean(axis=0)
+    y = y - y.mean(axis=0)
+    slope = (x*y).sum(axis=0)/(x*x).sum(axis=0)
+    tau = slope/(2*np.pi)
+
+    # Refine: minimize the circle fit residual. A rotation does not change the residual, so
+    # frequencies are taken from the start of the sweep and single precision is enough here.
+    fr = (f - f[0]).astype(np.float32)
+    z = xs.astype(np.complex64)
+    def residual(t):
+        a = (2*np.pi*fr*t).astype(np.float32)
+        return circle_residual(z*(np.cos(a) - 1j*np.sin(a)))
+
+    lo = tau - 0.5/(f.max(axis=0) - f.min(axis=0))
+    hi = 2*tau - lo
+    g = (np.sqrt(5) - 1)/2
+    t1 = hi - g*(hi - lo)
+    t2 = lo + g*(hi - lo)
+    e1 = residual(t1)
+    e2 = residual(t2)
+    for it in range(niter):
+        # Keep the side with the lower residual: its inner point is reused, one new point per tone.
+        left = e1 < e2
+        hi = np.where(left, t2, hi)
+        lo = np.where(left, lo, t1)
+        tk = np.where(left, t1, t2)
+        ek = np.where(left, e1, e2)
+        t = np.where(left, hi - g*(hi - lo), lo + g*(hi - lo))
+        e = residual(t)
+        t1 = np.where(left, t, tk)
+        e1 = np.where(left, e, ek)
+        t2 = np.where(left, tk, t)
+        e2 = np.where(left, ek, e)
+    if niter > 0:
+        tau = (lo + hi)/2
+
+    return tau
+
+def linear_phase(f, xs, weights=None):
+    """
+    Closed-form fit of a linear phase 2 pi f tau + phi0 to each tone, for sweeps without resonances
+    (e.g. a loopback or a line between resonators).
+
+    The slope of the mean phase step is removed first, so the unwrap cannot skip a turn between
+    points; a weighted line fit of the remaining phase gives the correction.
+
+    Parameters:
+    -----------
+        f: ndarray of doubles, shape (nf, ntone) or (nf,)
+            frequencies (MHz)
+        xs: ndarray of complex, shape (nf, ntone)
+            measured data
+        weights: ndarray of doubles or None (Default None)
+            weight of each point, None for |xs|**2
+
+    Returns:
+    --------
+        tau: ndarray of doubles, delay of each tone (us)
+        phi0: ndarray of doubles, phase of each tone at f = 0 (radians, in [-pi, pi])
+    """
+    xs = np.asarray(xs)
+    f = np.asarray(f, dtype=float)
+    if f.ndim < xs.ndim:
+        f = f[:,None]
+    f = np.broadcast_to(f, xs.shape)
+    w = np.abs(xs)**2 if weights is None else np.broadcast_to(weights, xs.shape)
+
+    # First slope: mean phase step over the mean frequency step.
+    step = np.angle((xs[1:]*np.conj(xs[:-1])).sum(axis=0))
+    slope0 = step/(f[1:] - f[:-1]).mean(axis=0)
+
+    # Weighted line fit of the remaining phase.
+    phi = np.unwrap(np.angle(xs*np.exp(-1j*slope0*f)), axis=0)
+    sw = w.sum(axis=0)
+    mx = (w*f).sum(axis=0)/sw
+    my = (w*phi).sum(axis=0)/sw
+    dx = f - mx
+    slope = (w*dx*(phi - my)).sum(axis=0)/(w*dx*dx).sum(axis=0)
+
+    tau = (slope0 + slope)/(2*np.pi)
+    phi0 = np.angle(np.exp(1j*(my - slope*mx)))
+    return tau, phi0
+
+def remove_delay(f, xs, tau):
+    """
+    Remove the cable delay tau (us, scalar or one per tone) from xs.
+    """
+    return xs*np.exp(-2j*np.pi*f*np.asarray(tau))
+
+def fit_circles(xs):
+    """
+    Algebraic (Kasa) circle fit of each tone.
+
+    Minimizes sum (x^2 + y^2 + D x + E y + F)^2, which is linear in D, E, F: one 3x3 system per tone,
+    solved for all tones at once. Points are centered first to keep the system well conditioned.
+
+    Parameters:
+    -----------
+        xs: ndarray of complex, shape (nf, ntone)
+
+    Returns:
+    --------
+        xc, yc, r: ndarrays of doubles, center and radius of each circle
+    """
+    m = xs.mean(axis=0)
+    z = xs - m
+    x = z.real
+    y = z.imag
+    w = x*x + y*y
+
+    # Normal equations: A [D, E, F] = b.
+    A = np.empty((xs.shape[1], 3, 3))
+    A[:,0,0] = (x*x).sum(axis=0)
+    A[:,0,1] = A[:,1,0] = (x*y).sum(axis=0)
+    A[:,0,2] = A[:,2,0] = x.sum(axis=0)
+    A[:,1,1] = (y*y).sum(axis=0)
+    A[:,1,2] = A[:,2,1] = y.sum(axis=0)
+    A[:,2,2] = xs.shape[0]
+    b = -np.stack([(w*x).sum(axis=0), (w*y).sum(axis=0), w.sum(axis=0)], axis=1)
+    D, E, F = np.linalg.solve(A, b[:,:,None])[:,:,0].T
+
+    xc = -D/2
+    yc = -E/2
+    r = np.sqrt(np.maximum(xc*xc + yc*yc - F, 0))
+
+    return xc + m.real, yc + m.imag, r
+
+def circle_residual(xs):
+    """
+    RMS distance of the points of each tone to their fitted circle.
+    """
+    xc, yc, r = fit_circles(xs)
+    d = np.abs(xs - (xc + 1j*yc)) - r
+    return np.sqrt((d*d).mean(axis=0))
+
+def fit_phase(f, theta, niter=10):
+    """
+    Gauss-Newton fit of theta(f) = theta0 - 2 s arctan(2 Qr (f/f0 - 1)) for all tones at once.
+
+    theta is the unwrapped angle of the points around the circle center. s = +/-1 is the direction
+    of rotation of each tone, taken from the data.
+
+    Parameters:
+    -----------
+        f: ndarray of doubles, shape (nf, ntone)
+            frequencies (MHz)
+        theta: ndarray of doubles, shape (nf, ntone)
+            unwrapped angle around the center
+        niter: int (Default 10)
+            number of iterations
+
+    Returns:
+    --------
+        theta0, Qr, f0: ndarrays of doubles, one value per tone
+    """
+    ntone = theta.shape[1]
+    tones = np.arange(ntone)
+    s = np.where(theta[-1] < theta[0], 1., -1.)
+
+    # Initial values: steepest point of theta and its slope (-4 s Qr/f0 at resonance).
+    dtheta = np.gradient(theta, axis=0)/np.gradient(f, axis=0)
+    i0 = np.argmax(s*-dtheta, axis=0)
+    f0 = f[i0, tones]
+    Qr = np.maximum(np.abs(dtheta[i0, tones])*f0/4, 1)
+    theta0 = theta[i0, tones]
+    p = np.stack([theta0, Qr, f0], axis=1)
+
+    # Bounds: resonance inside the sweep, linewidth between a tenth of a step and ten sweep widths.
+    fmin = f.min(axis=0)
+    fmax = f.max(axis=0)
+    df = np.abs(np.diff(f, axis=0)).min(axis=0)
+    Qmin = fmin/(10*(fmax - fmin))
+    Qmax = 10*fmax/df
+
+    for it in range(niter):
+        theta0, Qr, f0 = p.T
+        x = f/f0 - 1
+        u = 2*Qr*x
+        res = theta - (theta0 - 2*s*np.arctan(u))
+
+        # Jacobian of the model, one (nf, ntone) array per parameter.
+        dmdu = -2*s/(1 + u*u)
+        J = [np.ones_like(u), dmdu*2*x, dmdu*(-2*Qr*f/f0**2)]
+
+        # Column scaling keeps the normal equations well conditioned (Qr and f0 differ by decades).
+        scale = np.sqrt(np.stack([(c*c).sum(axis=0) for c in J], axis=1))
+        scale[scale == 0] = 1
+        J = [c/scale[:,i] for i, c in enumerate(J)]
+
+        # Normal equations of all tones: (ntone, 3, 3) and (ntone, 3).
+        JtJ = np.empty((len(tones), 3, 3))
+        for i in range(3):
+            for j in range(i, 3):
+                JtJ[:,i,j] = JtJ[:,j,i] = (J[i]*J[j]).sum(axis=0)
+        JtJ += 1e-9*np.eye(3)
+        Jtr = np.stack([(c*res).sum(axis=0) for c in J], axis=1)
+        step = np.linalg.solve(JtJ, Jtr[:,:,None])[:,:,0]/scale
+
+        p = p + step
+        p[:,1] = np.clip(p[:,1], Qmin, Qmax)
+        p[:,2] = np.clip(p[:,2], fmin, fmax)
+
+    theta0, Qr, f0 = p.T
+
+    return theta0, Qr, f0
+
+def fit_s21(f, xs, tau=None, niter=10):
+    """
+    Fit every resonator of a sweep.
+
+    Steps: cable delay removal, circle fit, phase fit around the circle center, and normalization
+    by the off-resonance point to get Qc and the impedance mismatch angle phi.
+
+    Parameters:
+    -----------
+        f: ndarray of doubles, shape (nf, ntone)
+            frequencies (MHz)
+        xs: ndarray of complex, shape (nf, ntone)
+            measured S21
+        tau: double, ndarray of doubles or None (Default None)
+            cable delay (us). None: estimate it per tone with estimate_delay()
+        niter: int (Default 10)
+            Gauss-Newton iterations
+
+    Returns:
+    --------
+        dict with, per tone:
+            'f0'    : resonance frequency (MHz)
+            'Qr'    : loaded quality factor
+            'Qc'    : coupling quality factor (real part of 1/Qc inverted)
+            'Qi'    : internal quality factor
+            'phi'   : impedance mismatch angle (radians)
+            'xc'    : I of the circle center, after delay removal
+            'yc'    : Q of the circle center, after delay removal
+            'r'     : circle radius, after delay removal
+            'a'     : off-resonance amplitude
+            'alpha' : off-resonance phase (radians)
+            'tau'   : cable delay (us)
+    """
+    f = np.asarray(f, dtype=float)
+    xs = np.asarray(xs)
+    if f.shape != xs.shape:
+        f = np.broadcast_to(f.reshape((-1,1)) if f.ndim == 1 else f, xs.shape)
+
+    # Cable delay.
+    if tau is None:
+        tau = estimate_delay(f, xs)
+    tau = np.broadcast_to(np.asarray(tau, dtype=float), (xs.shape[1],))
+    z = remove_delay(f, xs, tau)
+
+    # Circle.
+    xc, yc, r = fit_circles(z)
+    zc = xc + 1j*yc
+
+    # Angle around the center.
+    theta = np.unwrap(np.angle(z - zc), axis=0)
+    theta0, Qr, f0 = fit_phase(f, theta, niter=niter)
+
+    # Off-resonance point: opposite to the resonance point on the circle.
+    P = zc - r*np.exp(1j*theta0)
+    a = np.abs(P)
+    alpha = np.angle(P)
+
+    # Normalized circle: off-resonance point at 1.
+    zn = zc/P
+    rn = r/a
+    phi = -np.arcsin(np.clip(zn.imag/rn, -1, 1))
+
+    # Quality factors.
+    Qc_abs = Qr/(2*rn)
+    Qc = Qc_abs/np.cos(phi)
+    with np.errstate(divide='ignore'):
+        Qi = 1/(1/Qr - 1/Qc)
+
+    return {'f0' : f0, 'Qr' : Qr, 'Qc' : Qc, 'Qi' : Qi, 'phi' : phi,
+            'xc' : xc, 'yc' : yc, 'r' : r, 'a' : a, 'alpha' : alpha, 'tau' : tau}
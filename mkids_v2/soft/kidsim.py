@@ -0,0 +1,216 @@
+"""
+Software model of the AxisKidsimV3 resonator simulator.
+
+The IP has L lanes. Lane l processes the PFB channel punct_id*L + l, one sample per channel
+period (fs = channel sampling frequency, see AxisKidsimV3.configure()). Each lane:
+
+    1. DDS: phase accumulator of B_DDS bits with increment dds_freq_reg + sweep. The sweep adds
+       dds_slope_reg every (dds_wait_reg+1) samples, for dds_steps_reg steps, then starts over
+       (sawtooth from 0 to about dds_bval_reg).
+    2. Down-conversion of the input by the DDS, first order IIR notch
+
+           y[n] = c1 y[n-1] + g (x[n] - c0 x[n-1])
+
+       with c0, c1 and g the register values over 2**(B_COEF-1) (zero at c0, pole at c1,
+       unity gain far from the resonance), and up-conversion back by the DDS.
+    3. Output selection: 0 resonator, 1 dds, 2 input, 3 zero.
+
+This model follows the register semantics of the driver; use it to predict outputs and check
+quantization, not as a bit-exact replica of the firmware pipeline.
+"""
+import numpy as np
+
+
+class KidsimModel():
+    # Register names, as in AxisKidsimV3.set_registers().
+    KEYS = ['dds_bval_reg', 'dds_slope_reg', 'dds_steps_reg', 'dds_wait_reg', 'dds_freq_reg',
+            'iir_c0_reg', 'iir_c1_reg', 'iir_g_reg', 'outsel_reg', 'punct_id_reg']
+
+    # DDS bits.
+    B_DDS = 16
+
+    # Coefficient/gain bits.
+    B_COEF = 16
+
+    # Data bits.
+    B_DATA = 16
+
+    # Block size of the IIR recursion.
+    BLOCK = 64
+
+    def __init__(self, L=8):
+        self.L = L
+
+        # All lanes pass the input through.
+        self.regs = {k : np.zeros(L, dtype=np.int64) for k in self.KEYS}
+        self.regs['dds_steps_reg'][:] = 1
+        self.regs['outsel_reg'][:] = 2
+
+        self.reset()
+
+    @classmethod
+    def from_ip(cls, kidsim_b):
+        """Model with the geometry of an AxisKidsimV3 block"""
+        model = cls(L=kidsim_b.L)
+        model.B_DDS = kidsim_b.B_DDS
+        model.B_COEF = kidsim_b.B_COEF
+        return model
+
+    def reset(self):
+        # Sample counter, DDS phase and IIR state of each lane.
+        self.n = 0
+        self.phase = np.zeros(self.L, dtype=np.int64)
+        self.xprev = np.zeros(self.L, dtype=complex)
+        self.yprev = np.zeros(self.L, dtype=complex)
+
+    def set_registers(self, regs):
+        """
+        Load register values of one or many lanes.
+
+        Parameters:
+        -----------
+            regs: dict of arrays
+                register values and lane ('addr_reg'), e.g. the output of AxisKidsimV3.set_resonators()
+        """
+        lanes = np.atleast_1d(regs['addr_reg']).astype(int)
+        for k in self.KEYS:
+            if k in regs:
+                self.regs[k][lanes] = regs[k]
+
+    def coefficients(self):
+        """
+        Returns:
+        --------
+            c0, c1, g : ndarrays of doubles, IIR coefficients of each lane
+        """
+        q = 2**(self.B_COEF-1)
+        return self.regs['iir_c0_reg']/q, self.regs['iir_c1_reg']/q, self.regs['iir_g_reg']/q
+
+    def response(self, df, fs):
+        """
+        Frequency response of the resonator of each lane, with the quantized coefficients.
+
+        Parameters:
+        -----------
+            df: ndarray of doubles
+                offset from the DDS frequency (same units as fs)
+            fs: double
+                lane sampling frequency
+
+        Returns:
+        --------
+            h : ndarray of complex, shape (L, len(df))
+        """
+        c0, c1, g = self.coefficients()
+        z1 = np.exp(-2j*np.pi*np.atleast_1d(df)/fs)
+        return g[:,None]*(1 - c0[:,None]*z1)/(1 - c1[:,None]*z1)
+
+    def dds(self, nsamp):
+        """
+        DDS phase (radians) of each lane for the next nsamp samples. Advances the model state.
+
+        Returns:
+        --------
+            phi : ndarray of doubles, shape (L, nsamp)
+        """
+        n = self.n + np.arange(nsamp)
+        wait = self.regs['dds_wait_reg'][:,None] + 1
+        steps = np.maximum(self.regs['dds_steps_reg'][:,None], 1)
+
+        # Phase increment: center frequency plus sawtooth sweep.
+        pinc = self.regs['dds_freq_reg'][:,None] + self.regs['dds_slope_reg'][:,None]*((n//wait) % steps)
+
+        mask = 2**self.B_DDS - 1
+        acc = (self.phase[:,None] + np.cumsum(pinc, axis=1)) & mask
+        self.phase = acc[:,-1].copy()
+        self.n += nsamp
+
+        return 2*np.pi*acc/2**self.B_DDS
+
+    def run(self, x, quantize=True):
+        """
+        Output of all lanes for input x. Successive calls continue the same stream.
+
+        Parameters:
+        -----------
+            x: ndarray of complex, shape (L, nsamp)
+                input samples of each lane (I + jQ, in ADC units)
+            quantize: boolean (Default True)
+                round and saturate the output to B_DATA bits
+
+        Returns:
+        --------
+            y: ndarray of complex, shape (L, nsamp)
+        """
+        x = np.asarray(x, dtype=complex).reshape((self.L, -1))
+        nsamp = x.shape[1]
+        c0, c1, g = self.coefficients()
+
+        # Down-conversion.
+        rot = np.exp(1j*self.dds(nsamp))
+        xd = x*np.conj(rot)
+
+        # IIR: feed-forward part, then the recursion on the pole.
+        xd_prev = np.concatenate([self.xprev[:,None], xd[:,:-1]], axis=1)
+        u = g[:,None]*(xd - c0[:,None]*xd_prev)
+        yd = iir1(u, c1, self.yprev, self.BLOCK)
+        if nsamp > 0:
+            self.xprev = xd[:,-1].copy()
+            self.yprev = yd[:,-1].copy()
+
+        # Output selection.
+        sel = self.regs['outsel_reg'][:,None]
+        full = 2**(self.B_DATA-1) - 1
+        y = np.select([sel == 0, sel == 1, sel == 2], [yd*rot, full*rot, x], 0)
+
+        if quantize:
+            y = np.clip(np.round(y.real), -full-1, full) + 1j*np.clip(np.round(y.imag), -full-1, full)
+
+        return y
+
+def iir1(u, a, y0, B=64):
+    """
+    First order recursion y[n] = a y[n-1] + u[n] of many lanes, without a loop over samples.
+
+    Samples are processed in blocks of B with a (B, B) matrix of powers of a. The outputs at the
+    ends of the blocks follow the same recursion with coefficient a**B, solved the same way.
+
+    Parameters:
+    -----------
+        u: ndarray, shape (L, n)
+            input of each lane
+        a: ndarray of doubles, shape (L,)
+            coefficient of each lane (|a| < 1)
+        y0: ndarray, shape (L,)
+            output before the first sample
+
+    Returns:
+    --------
+        y: ndarray, shape (L, n)
+    """
+    L, n = u.shape
+    a = np.asarray(a, dtype=float)
+    y0 = np.asarray(y0)
+    m = min(n, B)
+
+    # Powers of a: T[l,i,j] = a**(i-j) for i >= j.
+    k = np.arange(m)
+    d = k[:,None] - k[None,:]
+    T = np.where(d >= 0, a[:,None,None]**np.maximum(d, 0), 0)
+    P = a[:,None]**(k+1)
+
+    if n <= B:
+        return np.matmul(T, u[:,:,None])[:,:,0] + P*y0[:,None]
+
+    # Zero state response of each block.
+    nb = -(-n//B)
+    U = np.zeros((L, nb*B), dtype=u.dtype)
+    U[:,:n] = u
+    Z = np.matmul(U.reshape((L, nb, B)), T.transpose(0,2,1))
+
+    # Output at the end of each block, and before the start of each block.
+    ends = iir1(Z[:,:,-1], a**B, y0, B)
+    starts = np.concatenate([y0[:,None], ends[:,:-1]], axis=1)
+
+    Y = Z + P[:,None,:]*starts[:,:,None]
+    return Y.reshape((L, -1))[:,:n]
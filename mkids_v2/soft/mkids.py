@@ -3,7 +3,13 @@ from qick.qick import *
 from drivers.pfb import *
 from drivers.dds import *
 from drivers.misc import *
+from reducers import *
+from fitting import *
 import numpy as np
+import time
+import os
+import json
+import hashlib
 
 from tqdm.notebook import trange, tqdm
 
@@ -375,6 +381,67 @@ class AnalysisChain():
             
             return streamer_b.get_data_all(verbose=verbose)
 
+    def get_data_tones(self, ntrans, idxs, nPreTruncate=0, verbose=False):
+        """
+        Get the data from all the enabled channels, demultiplexed per tone.
+
+        Parameters:
+        -----------
+            ntrans: ndarray of ints
+                transaction number of each tone
+            idxs: ndarray of ints
+                index of each tone within its transaction
+            nPreTruncate: int (Default 0)
+                number of samples to ignore at beginning of stream
+
+        Returns:
+        --------
+            xs: ndarray of complex64, shape (ntone, nsamp)
+        """
+        # Get blocks.
+        streamer_b = getattr(self.soc, self.dict['chain']['streamer'])
+
+        if verbose:
+            print("{}: Retrieving data for {} tones...".format(__class__.__name__, len(ntrans)))
+
+        packets = streamer_b.transfer()
+        return streamer_b.demux(packets, ntrans, idxs, nPreTruncate=nPreTruncate)
+
+    def reduce_tones(self, ntrans, idxs, reducers, nt=1, nPreTruncate=0, verbose=False):
+        """
+        Acquire nt transfers and accumulate per-tone statistics with the given reducers.
+        See AxisStreamerV1.reduce().
+        """
+        # Get blocks.
+        streamer_b = getattr(self.soc, self.dict['chain']['streamer'])
+
+        if verbose:
+            print("{}: Reducing data for {} tones...".format(__class__.__name__, len(ntrans)))
+
+        return streamer_b.reduce(ntrans, idxs, reducers, nt=nt, nPreTruncate=nPreTruncate)
+
+    async def get_data_tones_async(self, ntrans, idxs, nPreTruncate=0, verbose=False):
+        """
+        Same as get_data_tones(), but waiting for the DMA does not block the event loop.
+        """
+        # Get blocks.
+        streamer_b = getattr(self.soc, self.dict['chain']['streamer'])
+
+        if verbose:
+            print("{}: Retrieving data for {} tones (async)...".format(__class__.__name__, len(ntrans)))
+
+        packets = await streamer_b.transfer_async()
+        return streamer_b.demux(packets, ntrans, idxs, nPreTruncate=nPreTruncate)
+
+    def stream_tones(self, ntrans, idxs, blocksize=10000, nblocks=None, verbose=False):
+        """
+        Continuous acquisition of the enabled channels, in fixed-size blocks per tone.
+        See AxisStreamerV1.stream() for the format of each block.
+        """
+        # Get blocks.
+        streamer_b = getattr(self.soc, self.dict['chain']['streamer'])
+
+        return streamer_b.stream(ntrans, idxs, blocksize=blocksize, nblocks=nblocks, verbose=verbose)
         
     def freq2ch(self, f):
         """
@@ -881,10 +948,13 @@ class KidsChain():
         comp = cgs is not None
         if not comp:
             cgs = np.zeros(len(freqs))
-        dds_b.alloff()
-        for fOffset,fiDeg,g,cg,ch in zip(self.fOffsets, fiDegs, gs, cgs, self.chs):
-            if verbose: print("mkids.py set_tones:  fOffset, fiDeg, g, cg, ch, comp=",fOffset, fiDeg, g, cg, ch, comp)
-            dds_b.ddscfg(f=fOffset*1e6, fi=fiDeg, g=g, cg=cg, ch=ch, comp=comp, verbose=verbose)
+        if verbose:
+            for fOffset,fiDeg,g,cg,ch in zip(self.fOffsets, fiDegs, gs, cgs, self.chs):
+                print("mkids.py set_tones:  fOffset, fiDeg, g, cg, ch, comp=",fOffset, fiDeg, g, cg, ch, comp)
+
+        # Other channels are switched off. Only channels that change are written.
+        nw = dds_b.set_tones(self.chs, f=np.asarray(self.fOffsets)*1e6, fi=fiDegs, g=gs, cg=cgs, comp=comp, verbose=verbose)
+        if verbose: print("mkids.py set_tones:  %d dds channels written" % nw)
 
     def enable_channels(self, verbose=False):
         """
@@ -906,14 +976,11 @@ class KidsChain():
         if len(self.enabledChs) == len(chs) and (self.enabledChs==chs).all():
             if verbose: print("mkids.py:  enabledChs and chs identical")
         else:
-            if verbose: print("mkids.py:  set enabledChs and call chsel.alloff and chsel.set")
+            if verbose: print("mkids.py:  set enabledChs and call chsel.set_mask")
             self.enabledChs = np.array(self.chs)
             self.enabledChs.sort()
             chsel = getattr(self.soc, self.analysis.dict['chain']['chsel'])
-            chsel.alloff()
-            for ch in self.chs:
-                if verbose: print("mkids.py enable_channels: ch =",ch)
-                chsel.set(ch, single=False, verbose=verbose)
+            chsel.set_mask(self.chs, verbose=verbose)
                 
                 
     def get_sweep_offsets(self, bandwidth, nf):
@@ -1010,21 +1077,278 @@ class KidsChain():
             
         Returns:
         --------
-            xs : list of ndarrays
+            xs : ndarray of complex64, shape (ntone, nsamp)
                 complex values indexed by tone number
+                (if mean=True, ndarray of complex doubles with one value per tone)
         """
-        dataAll = self.analysis.get_data_all(verbose)
-        xs = []
-        samples = dataAll['samples']
-        for iTone in range(len(self.qFreqs)):
-            ntran = self.ntrans[iTone]
-            idx = self.idxs[iTone]
-            si = samples[ntran]
-            xs.append(si[2*idx][nPreTruncate:] + 1j*si[2*idx+1][nPreTruncate:])
-            if mean:
-                xs[iTone] = xs[iTone].mean()
+        if mean:
+            # Only the mean is needed: reduce straight from the DMA buffer.
+            [xs] = self.reduce_xs([MeanReducer()], nPreTruncate=nPreTruncate, verbose=verbose)
+        else:
+            xs = self.analysis.get_data_tones(self.ntrans, self.idxs, nPreTruncate=nPreTruncate, verbose=verbose)
         return xs 
 
+    def reduce_xs(self, reducers, nt=1, nPreTruncate=0, verbose=False):
+        """
+        Accumulate per-tone statistics of all tones without keeping the samples
+        
+        Parameters:
+        -----------
+            reducers: list
+                reducers from reducers.py, e.g. [MeanReducer(), VarianceReducer(), DecimateReducer(100)]
+            nt: int (Default 1)
+                number of dma transfers
+            nPreTruncate: int  (Default 0)
+                number of samples to ignore at beginning of stream
+            verbose:  boolean (Default False)
+                talk to me!
+            
+        Returns:
+        --------
+            results : list with the result of each reducer, tones in the order of set_tones()
+        """
+        return self.analysis.reduce_tones(self.ntrans, self.idxs, reducers, nt=nt, nPreTruncate=nPreTruncate, verbose=verbose)
+
+    async def get_xs_async(self, nPreTruncate=0, mean=False, verbose=False):
+        """
+        Same as get_xs(), for use in an asyncio event loop
+        
+        Waiting for the DMA yields to the event loop, so several chains (and e.g. a server)
+        can be served from one loop. Do not run two acquisitions on the same chain at once.
+        """
+        xs = await self.analysis.get_data_tones_async(self.ntrans, self.idxs, nPreTruncate=nPreTruncate, verbose=verbose)
+        if mean:
+            xs = xs.mean(axis=1, dtype=np.complex128)
+        return xs
+
+    async def produce_xs(self, queue, nblocks=None, nPreTruncate=0, mean=False, verbose=False):
+        """
+        Producer coroutine: put get_xs_async() results on an asyncio.Queue
+        
+        Use a bounded queue (asyncio.Queue(maxsize=...)) for backpressure: when consumers
+        fall behind, the producer waits on put() and no further acquisitions are started.
+
+        Parameters:
+        -----------
+            queue: asyncio.Queue
+                destination queue, can be shared by several chains
+            nblocks: int (Default None)
+                number of acquisitions, or None to run until cancelled
+            nPreTruncate, mean, verbose:
+                passed to get_xs_async()
+
+        Puts:
+        -----
+            item : dict
+                'chain' : name of this chain
+                'block' : acquisition number
+                'xs'    : result of get_xs_async()
+            and None once nblocks acquisitions are done.
+
+        Example:
+        --------
+            queue = asyncio.Queue(maxsize=4)
+            producers = [asyncio.create_task(c.produce_xs(queue)) for c in chains]
+            while True:
+                item = await queue.get()
+                process(item['chain'], item['xs'])
+        """
+        iblock = 0
+        while nblocks is None or iblock < nblocks:
+            xs = await self.get_xs_async(nPreTruncate=nPreTruncate, mean=mean, verbose=verbose)
+            await queue.put({'chain' : self.name, 'block' : iblock, 'xs' : xs})
+            iblock += 1
+
+        await queue.put(None)
+
+    def stream_xs(self, blocksize=10000, nblocks=None, verbose=False):
+        """
+        Continuous stream of the (complex) x values of all tones set by set_tones()
+        
+        Channels must be enabled with enable_channels() first. Memory use does not grow
+        with the duration of the run.
+
+        Parameters:
+        -----------
+            blocksize: int (Default 10000)
+                number of samples per tone in each block
+            nblocks: int (Default None)
+                number of blocks, or None to run until the generator is closed
+            verbose:  boolean (Default False)
+                talk to me!
+
+        Yields:
+        -------
+            block : dict
+                'xs'      : ndarray of complex64, shape (ntone, blocksize)
+                'block'   : block number
+                'dropped' : breaks in the transaction sequence since the previous block
+                            (0 when the data are contiguous)
+
+        Example:
+        --------
+            for block in chain.stream_xs(blocksize=10000):
+                if block['dropped']:
+                    print("lost data before block", block['block'])
+                process(block['xs'])
+        """
+        return self.analysis.stream_tones(self.ntrans, self.idxs, blocksize=blocksize, nblocks=nblocks, verbose=verbose)
+
+    def track_calibrate(self, df, tau=0, minSnr=5, nPreTruncate=100, verbose=False):
+        """
+        Calibration for track(): response of each tone set by set_tones() and its slope with frequency.
+
+        Three captures, with all tones at -df, 0 and +df from their current frequency. Tones are left
+        at their current frequency. A tone is trackable when its response changes over the 2*df step
+        by more than minSnr times the noise of the change: off resonance the slope is noise, and
+        tracking would move the tone on noise.
+
+        Parameters:
+        -----------
+            df: double
+                frequency step (MHz), a fraction of the resonator linewidth
+            tau: double or ndarray of doubles (Default 0)
+                cable delay (us), e.g. from fit_tones(). Moving a tone rotates its response by the
+                delay: with tau the rotation is removed and tracking has no bias
+            minSnr: double (Default 5)
+                minimum signal to noise ratio of the response change to track a tone
+            nPreTruncate: int  (Default 100)
+                number of samples to ignore at beginning of stream
+            verbose:  boolean (Default False)
+                talk to me!
+
+        Sets:
+        -----
+            self.trackCal : dict
+                'x0'   : ndarray of complex, response at the calibration frequency of each tone
+                'dxdf' : ndarray of complex, derivative of the response with frequency (1/MHz)
+                'df'   : frequency step
+                'freqs': calibration frequency of each tone
+                'tau'  : cable delay
+                'noise': ndarray of doubles, rms noise of the mean response of each tone
+                'trackable' : ndarray of booleans, tones with a slope above the noise
+        """
+        freqs = self.qFreqs
+        fis = self.fis
+        gs = self.gs
+        cgs = self.cgs
+        df = self.fq(df)
+
+        xs = []
+        var = []
+        for offset in [-df, df, 0]:
+            self.set_tones(freqs+offset, fis, gs, cgs)
+            self.enable_channels(verbose)
+            [stats] = self.reduce_xs([VarianceReducer()], nPreTruncate=nPreTruncate, verbose=verbose)
+            xs.append(stats['mean'])
+            var.append(stats['var']/stats['n'])
+
+        # Remove the delay rotation of the steps: only the resonance is tracked.
+        xs[0] = xs[0]*np.exp(2j*np.pi*df*np.asarray(tau))
+        xs[1] = xs[1]*np.exp(-2j*np.pi*df*np.asarray(tau))
+
+        # Noise of a mean response, and of the difference of two.
+        noise = np.sqrt(np.mean(var, axis=0))
+        trackable = np.abs(xs[1]-xs[0]) > minSnr*np.sqrt(2)*noise
+        if verbose:
+            print("{}: {} of {} tones trackable".format(__class__.__name__, trackable.sum(), len(trackable)))
+
+        self.trackCal = {'x0' : xs[2], 'dxdf' : (xs[1]-xs[0])/(2*df), 'df' : df, 'freqs' : np.array(freqs), 'tau' : tau,
+                         'noise' : noise, 'trackable' : trackable}
+
+    def track_offsets(self, xs):
+        """
+        Frequency shift of each resonator from the response xs of the tones (see track_calibrate()).
+
+        If the resonance moves by d, a tone at a fixed frequency sees x0 - dxdf*d: d is the projection
+        of xs - x0 on the rotation of the IQ response along the resonance circle.
+
+        Returns:
+        --------
+            dfs : ndarray of doubles, resonance shift of each tone (MHz), 0 for the tones that are not
+            trackable (see track_calibrate())
+        """
+        x0 = self.trackCal['x0']
+        dxdf = self.trackCal['dxdf']
+
+        # Remove the delay rotation since calibration.
+        xs = xs*np.exp(-2j*np.pi*(self.qFreqs - self.trackCal['freqs'])*self.trackCal['tau'])
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dfs = -np.real((xs - x0)*np.conj(dxdf))/np.abs(dxdf)**2
+        trackable = self.trackCal.get('trackable', np.ones(len(dfs), dtype=bool))
+        return np.where(trackable, np.nan_to_num(dfs), 0)
+
+    def track(self, rate=1, nupdates=None, threshold=None, gain=1, maxStep=None, nPreTruncate=100, verbose=False):
+        """
+        Keep the tones set by set_tones() on their resonators.
+
+        Each update takes one capture with get_xs(mean=True), estimates the resonance shift of each
+        tone with track_offsets(), and moves only the tones that shifted more than threshold. set_tones()
+        only writes the DDS channels that change. Calibrate first with track_calibrate().
+
+        Parameters:
+        -----------
+            rate: double (Default 1)
+                updates per second (None: as fast as possible)
+            nupdates: int (Default None)
+                number of updates, or None to run until the generator is closed
+            threshold: double (Default None)
+                minimum shift to move a tone (MHz). None: frequency resolution
+            gain: double (Default 1)
+                fraction of the estimated shift applied at each update
+            maxStep: double (Default None)
+                maximum move of a tone per update (MHz)
+            nPreTruncate: int  (Default 100)
+                number of samples to ignore at beginning of stream
+            verbose:  boolean (Default False)
+                talk to me!
+
+        Yields:
+        -------
+            update : dict
+                'update' : update number
+                'xs'     : ndarray of complex, response of each tone before the update
+                'dfs'    : ndarray of doubles, estimated resonance shift of each tone (MHz)
+                'moved'  : ndarray of booleans, tones that were moved
+                'trackable' : ndarray of booleans, tones that can be tracked (the others never move)
+                'freqs'  : ndarray of doubles, tone frequencies after the update (MHz)
+
+        Example:
+        --------
+            chain.track_calibrate(df=0.001)
+            for update in chain.track(rate=10):
+                log(update['freqs'])
+        """
+        if threshold is None:
+            threshold = self.fr
+
+        iupdate = 0
+        tnext = time.time()
+        while nupdates is None or iupdate < nupdates:
+            xs = self.get_xs(mean=True, nPreTruncate=nPreTruncate, verbose=verbose)
+            dfs = self.track_offsets(xs)
+
+            # Re-center tones that moved.
+            moved = np.abs(dfs) >= threshold
+            if moved.any():
+                step = gain*dfs*moved
+                if maxStep is not None:
+                    step = np.clip(step, -maxStep, maxStep)
+                self.set_tones(self.qFreqs+step, self.fis, self.gs, self.cgs)
+                self.enable_channels(verbose)
+                if verbose:
+                    print("{}: update {}, {} tones moved".format(__class__.__name__, iupdate, moved.sum()))
+
+            yield {'update' : iupdate, 'xs' : xs, 'dfs' : dfs, 'moved' : moved, 'freqs' : self.qFreqs,
+                   'trackable' : self.trackCal.get('trackable', np.ones(len(dfs), dtype=bool))}
+            iupdate += 1
+
+            # Rate.
+            if rate is not None:
+                tnext += 1/rate
+                time.sleep(max(tnext - time.time(), 0))
+
     def sweep(self, fstart, fend, N=10, g=0.5, decimation = 2, set_mixer=True, verbose=False, showProgress=True, doProgress=False, doPlotFirst=False):
         if set_mixer:
             # Set fmixer at the center of the sweep.
@@ -1104,6 +1428,372 @@ class KidsChain():
          
         return fq_v,a_v,phi_v
 
+    def sweep_comb(self, fstart, fend, N=10, g=0.5, decimation=2, stride=1, maxTones=None, set_mixer=True, nPreTruncate=100, verbose=False, doProgress=False):
+        """
+        Same measurement as sweep(), but with one tone per PFB channel stepped simultaneously.
+
+        Sweep points are grouped by PFB channel. At each step, the next point of every channel
+        is generated with set_tones() and all of them are read with a single get_xs(), so the
+        number of acquisitions is the number of points per channel instead of N.
+        
+        Parameters:
+        -----------
+            fstart, fend: double
+                sweep range (MHz)
+            N: int (Default 10)
+                number of points
+            g: double (Default 0.5)
+                total gain. Each tone gets g divided by the number of simultaneous tones, and
+                amplitudes are scaled back so they compare to sweep() at gain g
+            decimation: int (Default 2)
+                decimation of the analysis chain
+            stride: int (Default 1)
+                only use every stride-th channel at once (stride passes). Use 2 to keep tones out
+                of neighbor channels when they overlap at the channel edges
+            maxTones: int (Default None)
+                maximum number of simultaneous tones, None for no limit.
+                Noise cost: each tone is played at g/ntone and scaled back by ntone, so the noise of
+                every point grows with the number ntone of simultaneous tones. A larger stride or a
+                smaller maxTones means more acquisitions but less noise
+            set_mixer: boolean (Default True)
+                set the mixer at the center of the sweep
+            nPreTruncate: int (Default 100)
+                number of samples to ignore at beginning of stream
+            verbose: boolean (Default False)
+                talk to me!
+            doProgress: boolean (Default False)
+                show progress bar in a jupyter notebook
+
+        Returns:
+        --------
+            fq_v, a_v, phi_v: ndarrays
+                quantized frequencies, amplitudes and phases, as sweep()
+        """
+        if set_mixer:
+            # Set fmixer at the center of the sweep.
+            fmix = (fstart + fend)/2
+            fmix = self.fq(fmix)
+            self.set_mixer_frequency(fmix)
+
+        # Default settings.
+        self.analysis.set_decimation(decimation)
+        self.analysis.source("product")
+        
+        f_v = np.linspace(fstart,fend,N)
+
+        # Check frequency resolution.
+        fr = f_v[1] - f_v[0]
+        if fr < self.fr:
+            if verbose:
+                print("Required resolution too small. Redefining frequency vector with a resolution of {} MHz".format(self.fr))
+            f_v = np.arange(self.fq(fstart), self.fq(fend), self.fr)
+            N = len(f_v)
+        fq_v = self.fq(f_v)
+
+        xs = self.measure_comb(fq_v, g=g, stride=stride, maxTones=maxTones, nPreTruncate=nPreTruncate, verbose=verbose, doProgress=doProgress)
+
+        return fq_v, np.abs(xs), np.angle(xs)
+
+    def measure_comb(self, fq_v, g=0.5, stride=1, maxTones=None, nPreTruncate=100, verbose=False, doProgress=False):
+        """
+        Measure the mean complex value at each (quantized) frequency, one tone per PFB channel at once.
+        See sweep_comb() for parameters, and for the noise cost of many simultaneous tones. Mixer,
+        decimation and source must be already set.
+
+        Returns:
+        --------
+            xs : ndarray of complex doubles, one value per frequency
+        """
+        N = len(fq_v)
+        if N == 0:
+            return np.zeros(0, dtype=complex)
+
+        # PFB channel of each point.
+        pfb_b = getattr(self.soc, self.synthesis.dict['chain']['pfb'])
+        fmix = self.synthesis.dict['mixer']['freq']
+        k = np.asarray(pfb_b.freq2ch(fq_v-fmix)).astype(int)
+
+        # Step of each point: rank within its channel (at most one tone per channel and step).
+        order = np.argsort(k, kind='stable')
+        _, starts, inverse = np.unique(k[order], return_index=True, return_inverse=True)
+        step = np.empty(N, dtype=int)
+        step[order] = np.arange(N) - starts[inverse.reshape(-1)]
+
+        # Group of each point: pass (channel modulo stride) and step.
+        group = (k % stride)*(step.max()+1) + step
+
+        # Split groups larger than maxTones.
+        if maxTones is not None:
+            order = np.argsort(group, kind='stable')
+            _, starts, inverse = np.unique(group[order], return_index=True, return_inverse=True)
+            rank = np.empty(N, dtype=int)
+            rank[order] = np.arange(N) - starts[inverse.reshape(-1)]
+            group = group*(N//maxTones + 1) + rank//maxTones
+        groups, counts = np.unique(group, return_counts=True)
+
+        # Same gain for every tone of every group.
+        ntone = counts.max()
+        gt = g/ntone
+
+        if verbose:
+            print("{}: {} points, {} tones, {} acquisitions".format(__class__.__name__, N, ntone, len(groups)))
+
+        if doProgress:
+            iValues = trange(len(groups))
+        else:
+            iValues = range(len(groups))
+
+        xs = np.zeros(N, dtype=complex)
+        for i in iValues:
+            sel = np.nonzero(group == groups[i])[0]
+            self.set_tones(fq_v[sel], np.zeros(len(sel)), gt*np.ones(len(sel)))
+            self.enable_channels(verbose)
+            xs[sel] = self.get_xs(mean=True, nPreTruncate=nPreTruncate, verbose=verbose)
+
+        # Back to gain g.
+        return xs*ntone
+
+    def fit_tones(self, xs, bandwidth, nf, tau=None, niter=10):
+        """
+        Fit the resonators of a sweep_tones() measurement, all tones at once (see fitting.py).
+        
+        Parameters:
+        -----------
+            xs: ndarray of complex doubles, shape (nf, ntone)
+                result of sweep_tones(bandwidth, nf, mean=True)
+            bandwidth: double
+                nominal width of frequency scan, as given to sweep_tones()
+            nf: int
+                number of frequency values, as given to sweep_tones()
+            tau: double, ndarray of doubles or None (Default None)
+                cable delay (us), e.g. phase_fit() slope/(2 pi). None: estimate it from the data
+            niter: int (Default 10)
+                Gauss-Newton iterations
+
+        Returns:
+        --------
+            dict with per tone 'f0', 'Qr', 'Qc', 'Qi', 'phi', circle 'xc', 'yc', 'r', and 'a', 'alpha', 'tau'
+        """
+        f = self.qFreqs[None,:] + self.get_sweep_offsets(bandwidth, nf)[:,None]
+        return fit_s21(f, xs, tau=tau, niter=niter)
+
+    def measure_delays(self, bandwidth, nf, doProgress=False, verbose=False, nPreTruncate=100):
+        """
+        Delay of every tone set by set_tones() from one sweep of all of them, with the closed-form
+        fit of fitting.linear_phase(). Place the tones away from resonances.
+
+        Parameters:
+        -----------
+            bandwidth: double
+                nominal width of frequency scan
+            nf: int
+                number of frequency values
+
+        Returns:
+        --------
+            dict with per tone 'freqs' (MHz), synthesis channel 'ch', delay 'tau' (us) and phase
+            'phi0' (radians). 'tau' can be given to fit_tones() and fitting.remove_delay().
+        """
+        xs = self.sweep_tones(bandwidth, nf, doProgress=doProgress, verbose=verbose, nPreTruncate=nPreTruncate)
+        f = self.qFreqs[None,:] + self.get_sweep_offsets(bandwidth, nf)[:,None]
+        tau, phi0 = linear_phase(f, xs)
+
+        return {'freqs' : self.qFreqs, 'ch' : self.synthesis.freq2ch(self.qFreqs), 'tau' : tau, 'phi0' : phi0}
+
+    def sweep_adaptive(self, fstart, fend, N=1000, coarse=10, g=0.5, decimation=2, threshold=5, span=1, maxPoints=None, 
+                       stride=1, maxTones=None, set_mixer=True, nPreTruncate=100, verbose=False, doProgress=False):
+        """
+        Same as sweep_comb() on a grid of N points, but only every coarse-th point is measured first.
+        The grid is then measured densely around resonance candidates only (see refine_indices()).
+        
+        Parameters:
+        -----------
+            coarse: int (Default 10)
+                spacing of the coarse pass, in grid points
+            threshold: double (Default 5)
+                detection threshold, robust z-score of amplitude dips and phase slope changes
+            span: int (Default 1)
+                refine +/- span coarse intervals around each candidate
+            maxPoints: int (Default None)
+                maximum total number of measured points (None: no limit)
+            Other parameters as sweep_comb().
+
+        Returns:
+        --------
+            fq_v, a_v, phi_v: ndarrays
+                measured frequencies (increasing, not uniform), amplitudes and phases
+        """
+        if set_mixer:
+            # Set fmixer at the center of the sweep.
+            fmix = (fstart + fend)/2
+            fmix = self.fq(fmix)
+            self.set_mixer_frequency(fmix)
+
+        # Default settings.
+        self.analysis.set_decimation(decimation)
+        self.analysis.source("product")
+
+        # Fine grid.
+        f_v = np.linspace(fstart,fend,N)
+        if f_v[1] - f_v[0] < self.fr:
+            f_v = np.arange(self.fq(fstart), self.fq(fend), self.fr)
+            N = len(f_v)
+        fq_v = self.fq(f_v)
+
+        # Coarse pass.
+        idx = self.coarse_indices(N, coarse)
+        xs = np.full(N, np.nan, dtype=complex)
+        xs[idx] = self.measure_comb(fq_v[idx], g=g, stride=stride, maxTones=maxTones, nPreTruncate=nPreTruncate, verbose=verbose, doProgress=doProgress)
+
+        # Refinement.
+        new = self.refine_indices(xs[idx][:,None], idx, N, threshold=threshold, span=span, maxPoints=maxPoints)
+        if verbose:
+            print("{}: {} coarse points, {} refined points".format(__class__.__name__, len(idx), len(new)))
+        xs[new] = self.measure_comb(fq_v[new], g=g, stride=stride, maxTones=maxTones, nPreTruncate=nPreTruncate, verbose=verbose, doProgress=doProgress)
+
+        measured = ~np.isnan(xs)
+        return fq_v[measured], np.abs(xs[measured]), np.angle(xs[measured])
+
+    def sweep_tones_adaptive(self, bandwidth, nf, coarse=10, threshold=5, span=1, maxPoints=None, 
+                             doProgress=True, verbose=False, nPreTruncate=100):
+        """
+        Same as sweep_tones(mean=True), measuring every coarse-th offset first and then densely only
+        around resonance candidates of any tone (see refine_indices()).
+        
+        Parameters:
+        -----------
+            coarse, threshold, span, maxPoints:
+                see sweep_adaptive(). maxPoints counts frequency offsets.
+            Other parameters as sweep_tones().
+            
+        Returns:
+        --------
+            xs : ndarray of complex doubles, shape (nf, ntone) as sweep_tones()
+                Offsets that were not measured are linearly interpolated.
+
+        Sets:
+        -----
+            self.sweepMeasured : ndarray of booleans, True for measured offsets
+        """
+        fOffsets = self.get_sweep_offsets(bandwidth, nf)
+        freqs = self.qFreqs
+        fis = self.fis
+        gs = self.gs
+
+        def measure(indexes):
+            if doProgress:
+                iValues = tqdm(indexes)
+            else:
+                iValues = indexes
+            xs_ = []
+            for i in iValues:
+                self.set_tones(freqs+fOffsets[i], fis, gs)
+                self.enable_channels(verbose)
+                xs_.append(self.get_xs(mean=True, nPreTruncate=nPreTruncate, verbose=verbose))
+            return np.array(xs_).reshape((len(indexes), len(freqs)))
+
+        # Coarse pass.
+        xs = np.zeros((nf, len(freqs)), dtype=complex)
+        idx = self.coarse_indices(nf, coarse)
+        xs[idx] = measure(idx)
+
+        # Refinement.
+        new = self.refine_indices(xs[idx], idx, nf, threshold=threshold, span=span, maxPoints=maxPoints)
+        if verbose:
+            print("{}: {} coarse offsets, {} refined offsets".format(__class__.__name__, len(idx), len(new)))
+        xs[new] = measure(new)
+
+        # Fill the gaps.
+        self.sweepMeasured = np.zeros(nf, dtype=bool)
+        self.sweepMeasured[idx] = True
+        self.sweepMeasured[new] = True
+        im = np.nonzero(self.sweepMeasured)[0]
+        for t in range(len(freqs)):
+            xs[:,t] = np.interp(np.arange(nf), im, xs[im,t].real) + 1j*np.interp(np.arange(nf), im, xs[im,t].imag)
+
+        return xs
+
+    def coarse_indices(self, n, coarse):
+        """Indices of every coarse-th point of a grid of n points, including both ends"""
+        return np.unique(np.append(np.arange(0, n, max(int(coarse), 1)), n-1))
+
+    def refine_indices(self, xs, idx, n, threshold=5, span=1, maxPoints=None):
+        """
+        Grid points to measure around resonance candidates of a coarse pass.
+
+        A coarse point is a candidate when, for any tone, its amplitude dip below the median or the
+        change of phase slope next to it are more than threshold robust standard deviations away
+        (median absolute deviation, so the resonances themselves do not inflate the noise estimate).
+        With few coarse points the deviation can be about 0, so it is not taken below the spread of
+        the differences between neighbouring points. Candidates are refined by decreasing score while
+        the total stays within maxPoints; the window of the last one is shrunk to fit.
+
+        Parameters:
+        -----------
+            xs: ndarray of complex, shape (ncoarse, ntone)
+                coarse measurements
+            idx: ndarray of ints
+                grid index of each coarse point (increasing)
+            n: int
+                number of grid points
+
+        Returns:
+        --------
+            new: ndarray of ints, grid indices to measure (not in idx)
+        """
+        ncoarse = len(idx)
+        if ncoarse < 3:
+            return np.zeros(0, dtype=int)
+
+        def zscore(x):
+            med = np.median(x, axis=0)
+            mad = 1.4826*np.median(np.abs(x - med), axis=0)
+            step = 1.4826*np.median(np.abs(np.diff(x, axis=0)), axis=0)/np.sqrt(2)
+            scale = np.maximum(mad, step)
+            return (x - med)/np.where(scale > 0, scale, np.finfo(float).eps)
+
+        # Amplitude dips (relative to the baseline of each tone).
+        a = np.abs(xs)
+        z_a = -zscore(a/np.median(a, axis=0))
+
+        # Phase slope changes: large on either side of a coarse point.
+        dphi = np.diff(np.unwrap(np.angle(xs), axis=0), axis=0)
+        z_p = np.abs(zscore(dphi))
+        z_p = np.maximum(np.vstack([z_p[:1]*0, z_p]), np.vstack([z_p, z_p[-1:]*0]))
+
+        score = np.nanmax(np.maximum(z_a, z_p), axis=1)
+        cand = np.nonzero(score > threshold)[0]
+        cand = cand[np.argsort(-score[cand], kind='stable')]
+
+        # Refinement window of each candidate.
+        lo = idx[np.maximum(cand - span, 0)]
+        hi = idx[np.minimum(cand + span, ncoarse - 1)]
+
+        # Cap: keep the best candidates (overlaps are counted twice, so the cap is conservative).
+        if maxPoints is not None:
+            budget = maxPoints - ncoarse
+            total = np.cumsum(hi - lo - 1)
+            nkeep = np.count_nonzero(total <= budget)
+            if nkeep < len(cand):
+                # Shrink the window of the first candidate that does not fit to what is left.
+                left = budget - (total[nkeep-1] if nkeep > 0 else 0)
+                if left > 0:
+                    c = idx[cand[nkeep]]
+                    lo[nkeep] = max(lo[nkeep], c - left//2)
+                    hi[nkeep] = min(hi[nkeep], c + left - left//2)
+                    nkeep += 1
+                lo = lo[:nkeep]
+                hi = hi[:nkeep]
+
+        # Union of windows.
+        edges = np.zeros(n + 1, dtype=int)
+        np.add.at(edges, lo, 1)
+        np.add.at(edges, hi + 1, -1)
+        mask = np.cumsum(edges[:-1]) > 0
+        mask[idx] = False
+
+        return np.nonzero(mask)[0]
+
     def phase_slope(self, f, phi):
         # Compute phase jumps.
         dphi = np.diff(phi)
@@ -1128,9 +1818,7 @@ class KidsChain():
         phi_dt = phi_dt - phi_dt[0]
 
         # Phase-jump correction.
-        k = np.zeros(len(f))
-        for i in range(len(f)):
-            k[i] = self.synthesis.freq2ch(f[i])
+        k = np.asarray(self.synthesis.freq2ch(np.asarray(f)), dtype=float)
 
         # Apply jump compensation.
         phi_dt = phi_dt - phase_cal*(k - k[0])
@@ -1152,40 +1840,40 @@ class KidsChain():
             idx = np.argwhere(np.abs(phi_diff) > jv).reshape(-1)
             data['jump'] = {'threshold' : jv, 'index' : idx, 'value' : phi_diff[idx]}
             
-            idx_start = 0
-            idx_end = len(f)
-            for i in range(len(idx)):
-                idx_end = idx[i]
-                
-                # Move away from midpoint.
-                idx_start = idx_start + gap
-                idx_end = idx_end - gap
-                
-                x = f[idx_start:idx_end]
-                y = phi[idx_start:idx_end]
-                coef = np.polyfit(x,y,1)
-                fit_fn = np.poly1d(coef)
-                
-                fit_ = {'slope' : coef[0], 'data' : {'x' : x, 'y': y, 'fn' : fit_fn(x)}}
+            # Segment of each point: number of jumps before it.
+            f = np.asarray(f)
+            phi = np.asarray(phi)
+            n = len(f)
+            jump = np.zeros(n, dtype=int)
+            jump[idx] = 1
+            label = np.cumsum(jump)
+
+            # Keep points at least gap away from the segment ends.
+            k = np.arange(n)
+            starts = np.concatenate(([0], idx))
+            ends = np.concatenate((idx, [n]))
+            mask = (k >= starts[label] + gap) & (k < ends[label] - gap)
+            
+            # Least squares line of all segments at once (centered sums per segment).
+            nseg = len(idx) + 1
+            lab = label[mask]
+            x_all = f[mask]
+            y_all = phi[mask]
+            cnt = np.bincount(lab, minlength=nseg)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mx = np.bincount(lab, weights=x_all, minlength=nseg)/cnt
+                my = np.bincount(lab, weights=y_all, minlength=nseg)/cnt
+                dx = x_all - mx[lab]
+                sxx = np.bincount(lab, weights=dx*dx, minlength=nseg)
+                sxy = np.bincount(lab, weights=dx*(y_all - my[lab]), minlength=nseg)
+                slope = sxy/sxx
+            offset = my - slope*mx
+
+            # Same layout as a polyfit per segment.
+            split = np.cumsum(cnt)[:-1]
+            for i, (x, y) in enumerate(zip(np.split(x_all, split), np.split(y_all, split))):
+                fit_ = {'slope' : slope[i], 'data' : {'x' : x, 'y': y, 'fn' : slope[i]*x + offset[i]}}
                 data['fits'].append(fit_)
-                
-                # Update start index.
-                idx_start = idx_end + gap
-                
-            # Section after last jump.
-            idx_end = len(f)
-    
-            # Move away from midpoint.
-            idx_start = idx_start + gap
-            idx_end = idx_end - gap
-    
-            x = f[idx_start:idx_end]
-            y = phi[idx_start:idx_end]
-            coef = np.polyfit(x,y,1)
-            fit_fn = np.poly1d(coef)
-    
-            fit_ = {'slope' : coef[0], 'data' : {'x' : x, 'y': y, 'fn' : fit_fn(x)}}
-            data['fits'].append(fit_)        
             
             return data
         
@@ -1273,16 +1961,56 @@ class SimuChain():
         else:
             raise ValueError("Frequency value %f out of allowed range [%f,%f]" % (f,fmix-fs/2,fmix+fs/2))
 
+    def set_resonators(self, table, verbose=False):
+        """
+        Configure many resonators at once (see AxisKidsimV3.set_resonators()).
+
+        Parameters:
+        -----------
+            table: dict of arrays
+                'freq' : resonator frequency (MHz), required
+                other keys as in set_resonator(), arrays or scalars
+        """
+        # Get blocks.
+        pfb_b       = getattr(self.soc, self.analysis.dict['chain']['pfb'])
+        kidsim_b    = getattr(self.soc, self.analysis.dict['chain']['kidsim'])
+
+        # Sanity check: is frequency on allowed range?
+        fmix = abs(self.analysis.get_mixer_frequency())
+        fs = self.analysis.fs
+        f  = np.atleast_1d(table['freq'])
+
+        if np.any(f <= fmix-fs/2) or np.any(f >= fmix+fs/2):
+            raise ValueError("Frequency values out of allowed range [%f,%f]" % (fmix-fs/2,fmix+fs/2))
+
+        f_ = f - fmix
+        k = pfb_b.freq2ch(f_)
+
+        # Update config structure.
+        cfg = dict(table)
+        cfg['channel'] = k
+        cfg['dds_freq'] = f_ - pfb_b.ch2freq(k)
+
+        # Set resonators.
+        return kidsim_b.set_resonators(cfg, verbose=verbose)
+
 class MkidsSoc(Overlay, QickConfig):    
 
+    # Format of the topology cache files.
+    TOPOLOGY_VERSION = 1
+
     # Constructor.
-    def __init__(self, bitfile=None, force_init_clks=False, ignore_version=True, clk_output=None, external_clk=None, **kwargs):
+    def __init__(self, bitfile=None, force_init_clks=False, ignore_version=True, clk_output=None, external_clk=None, topology_cache=None, **kwargs):
         """
         Constructor method
+
+        topology_cache: file with the traced signal paths, re-used while the .hwh file does not change.
+        None or False (default): always trace. True: <bitfile>.topology.json next to the bitfile.
         """
 
         self.external_clk = external_clk
         self.clk_output = clk_output
+        self.topology_cache = topology_cache
 
         # Load bitstream.
         if bitfile is None:
@@ -1308,9 +2036,6 @@ class MkidsSoc(Overlay, QickConfig):
         self.rf = self.usp_rf_data_converter_0
         self.rf.configure(self)
 
-        # Extract the IP connectivity information from the HWH parser and metadata.
-        self.metadata = QickMetadata(self)
-
         self.map_signal_paths()
 
     def description(self):
@@ -1405,11 +2130,117 @@ class MkidsSoc(Overlay, QickConfig):
 
         return "\nQICK configuration:\n"+"\n".join(lines)
 
-    def map_signal_paths(self):
-        # Use the HWH parser to trace connectivity and deduce the channel numbering.
+    def topology_file(self):
+        if self.topology_cache is None or self.topology_cache is False:
+            return None
+        elif self.topology_cache is True:
+            return os.path.splitext(self.bitfile_name)[0] + '.topology.json'
+        else:
+            return self.topology_cache
+
+    def topology_hash(self):
+        # The connectivity is described by the .hwh file (the bitfile if there is none).
+        path = os.path.splitext(self.bitfile_name)[0] + '.hwh'
+        if not os.path.isfile(path):
+            path = self.bitfile_name
+
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def trace_connections(self):
+        """
+        Trace the connectivity with the HWH parser (slow).
+
+        Returns:
+        --------
+            topology: dict, per block with configure_connections(): type, HAS_* flags and the
+            entries added to its dictionary
+        """
+        # Extract the IP connectivity information from the HWH parser and metadata.
+        self.metadata = QickMetadata(self)
+
+        topology = {}
         for key, val in self.ip_dict.items():
             if hasattr(val['driver'], 'configure_connections'):
-                getattr(self, key).configure_connections(self)
+                block = getattr(self, key)
+                before = dict(block.dict)
+                block.configure_connections(self)
+
+                flags = {a : getattr(block, a) for a in dir(type(block)) if a.startswith('HAS_')}
+                found = {k : v for k, v in block.dict.items() if k not in before or before[k] is not v}
+                topology[key] = {'type' : val['type'], 'flags' : flags, 'dict' : found}
+
+        return topology
+
+    def load_topology(self, filename, hash_):
+        """
+        Returns:
+        --------
+            topology from the cache file, or None if missing or not valid for this firmware
+        """
+        try:
+            with open(filename) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if cache.get('version') != self.TOPOLOGY_VERSION or cache.get('hash') != hash_:
+            return None
+
+        # Same blocks, and all the blocks and converters they are connected to exist.
+        topology = cache['topology']
+        blocks = {key : val['type'] for key, val in self.ip_dict.items() if hasattr(val['driver'], 'configure_connections')}
+        if blocks != {key : val['type'] for key, val in topology.items()}:
+            return None
+        for val in topology.values():
+            for k, v in val['dict'].items():
+                if isinstance(v, str) and v not in self.ip_dict:
+                    return None
+                if k == 'adc' and v['id'] not in self.adcs:
+                    return None
+                if k == 'dac' and v['id'] not in self.dacs:
+                    return None
+
+        return topology
+
+    def save_topology(self, filename, hash_, topology):
+        cache = {'version' : self.TOPOLOGY_VERSION, 'hash' : hash_, 'topology' : topology}
+        tmp = filename + '.tmp'
+        try:
+            # Write and rename: a half-written file is never read.
+            with open(tmp, 'w') as f:
+                json.dump(cache, f, indent=2)
+            os.replace(tmp, filename)
+        except (OSError, TypeError) as e:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            print("{}: could not write topology cache {}: {}".format(__class__.__name__, filename, e))
+
+    def map_signal_paths(self):
+        # Connectivity and channel numbering: from the topology cache if it matches the .hwh file,
+        # otherwise traced with the HWH parser.
+        filename = self.topology_file()
+        topology = None
+        if filename is not None:
+            hash_ = self.topology_hash()
+            topology = self.load_topology(filename, hash_)
+
+        if topology is None:
+            topology = self.trace_connections()
+            if filename is not None:
+                self.save_topology(filename, hash_, topology)
+        else:
+            for key, val in topology.items():
+                block = getattr(self, key)
+                block.soc = self
+                for a, v in val['flags'].items():
+                    setattr(block, a, v)
+                block.dict.update(val['dict'])
 
         # PFB for Analysis.
         self.pfbs_in = []
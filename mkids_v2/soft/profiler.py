@@ -0,0 +1,275 @@
+"""
+Opt-in instrumentation of register writes and DMA transfers.
+
+While a Profiler is enabled:
+
+    * every register write of a SocIp driver (ip.reg = value) is counted per IP and register.
+    * the DMA channels of the streamers time every transfer() and wait().
+    * the streamers time transfer() and the decode methods (demux, demux_all, get_data_all).
+    * any other method can be timed with trace(), and any block of code with span().
+
+Timed calls also record how many register writes they issued. Nothing is patched until
+enable() and everything is restored by disable(), so the drivers run their normal code when
+the profiler is off.
+
+Usage:
+    prof = Profiler(soc)
+    prof.trace(chain, 'set_tones')
+    with prof:
+        chain.set_tones(freqs, fis, gs)
+        xs = chain.get_xs()
+    prof.summary()
+    prof.export_chrome('trace.json')
+
+The Chrome trace opens in chrome://tracing or https://ui.perfetto.dev.
+"""
+import time
+import json
+import inspect
+from contextlib import contextmanager
+import numpy as np
+from qick.qick import SocIp
+
+from drivers.misc import AxisStreamerV1
+
+
+class Profiler():
+    # Methods timed on the streamers and on their DMA receive channels.
+    STREAMER_METHODS = ['transfer', 'demux', 'demux_all', 'get_data_all']
+    DMA_METHODS = ['transfer', 'wait', 'wait_async']
+
+    # Enabled profiler: SocIp.__setattr__ can only be patched once.
+    active = None
+
+    def __init__(self, soc=None):
+        self.soc = soc
+
+        # Methods to time when enabled: (object, method name, event name, category).
+        self.targets = []
+        if soc is not None:
+            for key, val in soc.ip_dict.items():
+                if val['driver'] is None or not issubclass(val['driver'], AxisStreamerV1):
+                    continue
+                streamer = getattr(soc, key)
+                for m in self.STREAMER_METHODS:
+                    self.targets.append((streamer, m, "%s.%s" % (key, m), 'streamer' if m == 'transfer' else 'decode'))
+
+                # DMA of the streamer (set by map_signal_paths).
+                if hasattr(streamer, 'dma'):
+                    for m in self.DMA_METHODS:
+                        if hasattr(streamer.dma.recvchannel, m):
+                            self.targets.append((streamer.dma.recvchannel, m, "%s.dma.%s" % (key, m), 'dma'))
+
+        # Patched attributes, to restore on disable().
+        self.patches = []
+
+        self.reset()
+
+    def reset(self):
+        """Clear counts and events"""
+        # Register writes: (ip, register) -> count.
+        self.writes = {}
+        self.nwrites = 0
+
+        # Timed calls: dicts with name, cat, t (seconds from t0), dur (seconds) and args.
+        self.events = []
+        self.t0 = time.perf_counter()
+
+    def trace(self, obj, method, name=None, cat='user'):
+        """
+        Time every call of obj.method while enabled.
+
+        Parameters:
+        -----------
+            obj: object
+                e.g. a KidsChain
+            method: string
+                method name
+            name: string or None (Default None)
+                event name (default obj class.method)
+            cat: string (Default 'user')
+                event category
+        """
+        # Already timed (e.g. a streamer method): keep the first target.
+        if any(t[0] is obj and t[1] == method for t in self.targets):
+            return
+        if name is None:
+            name = "%s.%s" % (type(obj).__name__, method)
+        self.targets.append((obj, method, name, cat))
+        if self.enabled:
+            self.patch_method(obj, method, name, cat)
+
+    @property
+    def enabled(self):
+        return Profiler.active is self
+
+    def enable(self):
+        if Profiler.active is self:
+            return
+        if Profiler.active is not None:
+            raise RuntimeError("Profiler: another profiler is enabled")
+        Profiler.active = self
+
+        # Register writes.
+        setattr_ip = SocIp.__setattr__
+        prof = self
+        def __setattr__(ip, a, v):
+            if a in ip.REGISTERS:
+                key = (ip.fullpath, a)
+                prof.writes[key] = prof.writes.get(key, 0) + 1
+                prof.nwrites += 1
+            setattr_ip(ip, a, v)
+        SocIp.__setattr__ = __setattr__
+        self.patches.append((SocIp, '__setattr__', setattr_ip))
+
+        # Timed methods.
+        for obj, method, name, cat in self.targets:
+            self.patch_method(obj, method, name, cat)
+
+    def disable(self):
+        if Profiler.active is not self:
+            return
+
+        # Restore in reverse order. Instance attributes that did not exist are removed.
+        try:
+            for obj, attr, old in reversed(self.patches):
+                if isinstance(obj, type):
+                    type.__setattr__(obj, attr, old)
+                elif old is None:
+                    obj.__dict__.pop(attr, None)
+                else:
+                    obj.__dict__[attr] = old
+        finally:
+            self.patches = []
+            Profiler.active = None
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *args):
+        self.disable()
+
+    def patch_method(self, obj, method, name, cat):
+        fn = getattr(obj, method)
+        prof = self
+
+        if inspect.iscoroutinefunction(fn):
+            async def timed(*args, **kwargs):
+                t, w = time.perf_counter(), prof.nwrites
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    prof.record(name, cat, t, w, args)
+        else:
+            def timed(*args, **kwargs):
+                t, w = time.perf_counter(), prof.nwrites
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    prof.record(name, cat, t, w, args)
+
+        # Instance attribute: only this object is affected.
+        old = obj.__dict__.get(method)
+        object.__setattr__(obj, method, timed)
+        self.patches.append((obj, method, old))
+
+    def record(self, name, cat, t, w, args=()):
+        dur = time.perf_counter() - t
+        event = {'name' : name, 'cat' : cat, 't' : t - self.t0, 'dur' : dur, 'args' : {'writes' : self.nwrites - w}}
+
+        # Size of DMA buffers.
+        if cat == 'dma' and len(args) > 0 and hasattr(args[0], 'nbytes'):
+            event['args']['nbytes'] = int(args[0].nbytes)
+
+        self.events.append(event)
+
+    @contextmanager
+    def span(self, name, cat='user'):
+        """
+        Time a block of code:
+
+            with prof.span('sweep'):
+                ...
+        """
+        t, w = time.perf_counter(), self.nwrites
+        try:
+            yield
+        finally:
+            if self.enabled:
+                self.record(name, cat, t, w)
+
+    def durations(self, name):
+        """Durations (seconds) of the events with this name"""
+        return np.array([e['dur'] for e in self.events if e['name'] == name])
+
+    def histogram(self, name, bins=20):
+        """
+        Histogram of the durations of the events with this name.
+
+        Returns:
+        --------
+            counts, edges : as np.histogram, edges in seconds
+        """
+        return np.histogram(self.durations(name), bins=bins)
+
+    def stats(self):
+        """
+        Returns:
+        --------
+            dict, per event name: count, total, mean, min, max (seconds) and register writes
+        """
+        stats = {}
+        for name in dict.fromkeys(e['name'] for e in self.events):
+            evs = [e for e in self.events if e['name'] == name]
+            d = np.array([e['dur'] for e in evs])
+            stats[name] = { 'count'  : len(d),
+                            'total'  : d.sum(),
+                            'mean'   : d.mean(),
+                            'min'    : d.min(),
+                            'max'    : d.max(),
+                            'writes' : sum(e['args']['writes'] for e in evs)}
+        return stats
+
+    def writes_per_ip(self):
+        """Register writes per IP: dict ip -> {register : count}"""
+        ips = {}
+        for (ip, reg), n in sorted(self.writes.items()):
+            ips.setdefault(ip, {})[reg] = n
+        return ips
+
+    def summary(self):
+        print("Register writes: %d" % self.nwrites)
+        for ip, regs in self.writes_per_ip().items():
+            print("  %-40s %8d" % (ip, sum(regs.values())))
+            for reg, n in regs.items():
+                print("    %-38s %8d" % (reg, n))
+
+        print("Timed calls:")
+        for name, s in self.stats().items():
+            print("  %-40s count = %6d, total = %10.3f ms, mean = %10.3f ms, max = %10.3f ms, writes = %d" %
+                  (name, s['count'], 1e3*s['total'], 1e3*s['mean'], 1e3*s['max'], s['writes']))
+
+    def to_dict(self):
+        return {'writes' : [{'ip' : ip, 'reg' : reg, 'count' : n} for (ip, reg), n in sorted(self.writes.items())],
+                'events' : self.events,
+                'stats'  : self.stats()}
+
+    def export_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def export_chrome(self, filename):
+        """
+        Write the events in the Chrome trace event format (complete events, times in us).
+        """
+        events = [{ 'name' : e['name'],
+                    'cat'  : e['cat'],
+                    'ph'   : 'X',
+                    'ts'   : 1e6*e['t'],
+                    'dur'  : 1e6*e['dur'],
+                    'pid'  : 0,
+                    'tid'  : 0,
+                    'args' : e['args']} for e in self.events]
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents' : events, 'displayTimeUnit' : 'ms'}, f)
@@ -0,0 +1,146 @@
+"""
+Per-tone reducers for AxisStreamerV1.reduce().
+
+Each DMA transfer is demultiplexed on its own and handed to the reducers as a zero-padded
+(ntone, nmax) complex64 array plus the number of valid samples of each tone. Reducers keep
+running statistics only, so memory does not depend on the number of transfers.
+
+A reducer implements:
+    reset(ntone)        : clear state for ntone tones.
+    update(xs, lengths) : accumulate one block.
+    result()            : return the statistics.
+"""
+import numpy as np
+
+
+class MeanReducer():
+    """ Mean of each tone """
+    def reset(self, ntone):
+        self.n = np.zeros(ntone, dtype=int)
+        self.s = np.zeros(ntone, dtype=complex)
+
+    def update(self, xs, lengths):
+        # Padding is zero: it does not change the sum.
+        self.s += xs.sum(axis=1, dtype=complex)
+        self.n += lengths
+
+    def result(self):
+        """
+        Returns:
+        --------
+            mean : ndarray of complex doubles, one value per tone
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.s/self.n
+
+class VarianceReducer():
+    """ Mean and variance of each tone (Welford, updated one block at a time) """
+    def reset(self, ntone):
+        self.n = np.zeros(ntone, dtype=int)
+        self.mean = np.zeros(ntone, dtype=complex)
+        self.m2i = np.zeros(ntone)
+        self.m2q = np.zeros(ntone)
+
+    def update(self, xs, lengths):
+        valid = np.arange(xs.shape[1]) < lengths[:,None]
+
+        # Block statistics.
+        nb = lengths
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mb = np.where(nb > 0, xs.sum(axis=1, dtype=complex)/nb, 0)
+        d = np.where(valid, xs - mb[:,None], 0)
+        m2bi = (d.real**2).sum(axis=1)
+        m2bq = (d.imag**2).sum(axis=1)
+
+        # Combine with running statistics (Chan et al. parallel update).
+        n = self.n + nb
+        nz = n > 0
+        delta = mb - self.mean
+        w = np.zeros(len(n))
+        w[nz] = nb[nz]/n[nz]
+        self.mean = self.mean + delta*w
+        self.m2i = self.m2i + m2bi + delta.real**2*self.n*w
+        self.m2q = self.m2q + m2bq + delta.imag**2*self.n*w
+        self.n = n
+
+    def result(self):
+        """
+        Returns:
+        --------
+            dict with, per tone:
+                'n'     : number of samples
+                'mean'  : mean (complex)
+                'var_i' : variance of I
+                'var_q' : variance of Q
+                'var'   : variance of x, E|x-mean|^2 = var_i + var_q
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            var_i = self.m2i/self.n
+            var_q = self.m2q/self.n
+        return {'n' : self.n.copy(), 'mean' : self.mean.copy(), 'var_i' : var_i, 'var_q' : var_q, 'var' : var_i + var_q}
+
+class MinMaxReducer():
+    """ Minimum and maximum of I and Q of each tone """
+    def reset(self, ntone):
+        self.imin = np.full(ntone, np.inf)
+        self.imax = np.full(ntone, -np.inf)
+        self.qmin = np.full(ntone, np.inf)
+        self.qmax = np.full(ntone, -np.inf)
+
+    def update(self, xs, lengths):
+        valid = np.arange(xs.shape[1]) < lengths[:,None]
+        self.imin = np.minimum(self.imin, np.where(valid, xs.real, np.inf).min(axis=1, initial=np.inf))
+        self.imax = np.maximum(self.imax, np.where(valid, xs.real, -np.inf).max(axis=1, initial=-np.inf))
+        self.qmin = np.minimum(self.qmin, np.where(valid, xs.imag, np.inf).min(axis=1, initial=np.inf))
+        self.qmax = np.maximum(self.qmax, np.where(valid, xs.imag, -np.inf).max(axis=1, initial=-np.inf))
+
+    def result(self):
+        """
+        Returns:
+        --------
+            dict with 'imin', 'imax', 'qmin', 'qmax', one value per tone
+        """
+        return {'imin' : self.imin.copy(), 'imax' : self.imax.copy(), 'qmin' : self.qmin.copy(), 'qmax' : self.qmax.copy()}
+
+class DecimateReducer():
+    """ Decimated copy of each tone: average of every `factor` consecutive samples """
+    def __init__(self, factor=100):
+        if factor < 1:
+            raise ValueError("decimation factor must be at least 1")
+        self.factor = factor
+
+    def reset(self, ntone):
+        # Samples not yet decimated (less than factor per tone, plus at most one block).
+        self.carry = np.zeros((ntone, 0), dtype=np.complex64)
+        self.fill = np.zeros(ntone, dtype=int)
+        self.out = []
+
+    def update(self, xs, lengths):
+        # Append the block after the leftover samples of each tone.
+        ntone = len(lengths)
+        cap = self.fill.max(initial=0) + xs.shape[1]
+        buf = np.zeros((ntone, cap), dtype=np.complex64)
+        buf[:,:self.carry.shape[1]] = self.carry
+        cols = self.fill[:,None] + np.arange(xs.shape[1])
+        valid = np.arange(xs.shape[1]) < lengths[:,None]
+        tones = np.broadcast_to(np.arange(ntone)[:,None], cols.shape)
+        buf[tones[valid], cols[valid]] = xs[valid]
+        self.fill = self.fill + lengths
+
+        # Decimate what is available for all tones.
+        nd = self.fill.min()//self.factor if ntone > 0 else 0
+        if nd > 0:
+            self.out.append(buf[:,:nd*self.factor].reshape((ntone, nd, self.factor)).mean(axis=2))
+            buf = buf[:,nd*self.factor:]
+            self.fill = self.fill - nd*self.factor
+        self.carry = buf[:,:self.fill.max(initial=0)]
+
+    def result(self):
+        """
+        Returns:
+        --------
+            xs : ndarray of complex64, shape (ntone, nsamp//factor)
+        """
+        if len(self.out) == 0:
+            return np.zeros((len(self.fill), 0), dtype=np.complex64)
+        return np.concatenate(self.out, axis=1)
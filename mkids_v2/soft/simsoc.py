@@ -0,0 +1,416 @@
+"""
+Simulated MkidsSoc backend, without a board.
+
+SimMkidsSoc reads the ip dictionary and the connectivity from a .hwh file (as the PYNQ HWH parser
+does) and builds the same drivers as MkidsSoc, but on top of:
+
+    SimMMIO       : register file in memory, one 32-bit word per register.
+    SimRFDC       : RF data converter keeping mixer frequencies and Nyquist zones in memory.
+    SimDma        : axi_dma with configurable latency and bandwidth. Receive transfers are filled
+                    with synthetic packets in the 512-bit streamer format (SimStreamSource).
+                    SimReplaySource replays recorded buffers instead.
+    sim_allocate  : DMA buffers on regular memory.
+
+map_signal_paths(), KidsChain and SimuChain run unchanged on top of it:
+
+    soc = SimMkidsSoc('../zcu216/mkids_2x2_kidsim_v2.hwh', latency=1e-4, bandwidth=1e9)
+    chain = KidsChain(soc, dual=soc['dual'][0])
+"""
+import os
+import time
+import asyncio
+import xml.etree.ElementTree as ET
+import numpy as np
+import pynq.overlay
+from pynq.overlay import DefaultIP
+
+from mkids import *
+
+
+class SimMMIO():
+    """
+    Register file in memory, with the interface of pynq.MMIO.
+    """
+    def __init__(self, base_addr, length=4, device=None, **kwargs):
+        self.base_addr = base_addr
+        self.length = length
+        self.device = device
+        self.array = np.zeros(max(length//4, 1), dtype=np.uint32)
+
+    def read(self, offset=0, length=4):
+        return int(self.array[offset//4])
+
+    def write(self, offset, data):
+        self.array[offset//4] = np.uint32(int(data) & 0xffffffff)
+
+class SimBuffer(np.ndarray):
+    """
+    DMA buffer on regular memory, with the interface of pynq buffers.
+    """
+    physical_address = 0
+
+    def freebuffer(self):
+        pass
+
+    def close(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def invalidate(self):
+        pass
+
+def sim_allocate(shape, dtype=np.uint32, **kwargs):
+    return np.zeros(shape, dtype=dtype).view(SimBuffer)
+
+class SimDmaChannel():
+    """
+    One direction of a simulated axi_dma.
+
+    A transfer completes latency + nbytes/bandwidth seconds after it is armed: wait() sleeps until
+    then, wait_async() awaits until then. Receive transfers are filled by the source, called with the buffer as argument.
+    """
+    def __init__(self, latency=0, bandwidth=None, source=None):
+        # Latency (seconds) and bandwidth (bytes/second, None for no limit).
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.source = source
+
+        # Completion time of the armed transfer.
+        self.deadline = None
+
+    @property
+    def running(self):
+        return self.deadline is not None
+
+    @property
+    def idle(self):
+        return self.deadline is None or time.perf_counter() >= self.deadline
+
+    def transfer(self, array, start=0, nbytes=0):
+        if self.deadline is not None:
+            raise RuntimeError("DMA channel not idle")
+
+        if nbytes == 0:
+            nbytes = array.nbytes - start
+
+        # Data.
+        if self.source is not None:
+            self.source(array)
+
+        # Completion time.
+        dt = self.latency
+        if self.bandwidth is not None:
+            dt += nbytes/self.bandwidth
+        self.deadline = time.perf_counter() + dt
+
+    def wait(self):
+        if self.deadline is None:
+            raise RuntimeError("DMA channel not started")
+        dt = self.deadline - time.perf_counter()
+        if dt > 0:
+            time.sleep(dt)
+        self.deadline = None
+
+    async def wait_async(self):
+        if self.deadline is None:
+            raise RuntimeError("DMA channel not started")
+        dt = self.deadline - time.perf_counter()
+        if dt > 0:
+            await asyncio.sleep(dt)
+        else:
+            # Let other tasks run, as the hardware wait does.
+            await asyncio.sleep(0)
+        self.deadline = None
+
+class SimDma():
+    """
+    Simulated axi_dma: a receive and a send channel.
+    """
+    def __init__(self, description, latency=0, bandwidth=None):
+        self.description = description
+        self.fullpath = description['fullpath']
+        self.recvchannel = SimDmaChannel(latency, bandwidth)
+        self.sendchannel = SimDmaChannel(latency, bandwidth)
+
+class SimRFDC(RFDC):
+    """
+    RF data converter without hardware: mixer settings and Nyquist zones are kept in memory.
+    """
+    bindto = []
+
+    class Block():
+        def __init__(self, mode):
+            # Fine mixer, updated on tile events.
+            self.MixerSettings = {'Freq' : 0, 'PhaseOffset' : 0, 'MixerMode' : mode, 'MixerType' : 2, 'EventSource' : 2}
+            self.NyquistZone = 1
+
+        def UpdateEvent(self, event):
+            pass
+
+    class Tile():
+        def __init__(self, mode):
+            self.blocks = [SimRFDC.Block(mode) for i in range(4)]
+
+    def __init__(self, description):
+        self.description = description
+        self.adc_tiles = [SimRFDC.Tile(mode=3) for i in range(4)]
+        self.dac_tiles = [SimRFDC.Tile(mode=2) for i in range(4)]
+
+        # Dictionary for configuration.
+        self.dict = {}
+
+        # Initialize nqz and freq.
+        self.dict['nqz']  = {'adc' : {}, 'dac' : {}}
+        self.dict['freq'] = {'adc' : {}, 'dac' : {}}
+
+class SimStreamSource():
+    """
+    Synthetic packets for the DMA of one streamer.
+
+    Packets cycle over the transactions enabled in the channel selector, as the firmware does. Each
+    packet holds L samples (I, Q) of the channels of its transaction and the transaction number, in
+    the NS_TR int16 words of one 512-bit streamer transaction.
+
+    Samples come from signal(chs, t), with chs the channels (npackets, L) and t the frame number of
+    each packet (npackets,). The default is a loopback of the dual DDS: a constant of amplitude
+    amplitude*g and phase fi of the tone of each channel, plus gaussian noise of rms noise.
+    """
+    def __init__(self, streamer, chsel, dds=None, signal=None, amplitude=10000, noise=10, seed=None):
+        self.streamer = streamer
+        self.chsel = chsel
+        self.dds = dds
+        self.signal = self.loopback if signal is None else signal
+        self.amplitude = amplitude
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+
+        # Packets sent so far (the stream is continuous over transfers).
+        self.n = 0
+
+    def loopback(self, chs, t):
+        x = np.zeros(chs.shape, dtype=complex)
+        if self.dds is not None and hasattr(self.dds, 'shadow'):
+            valid = chs < len(self.dds.shadow)
+            regs = self.dds.shadow[np.where(valid, chs, 0)]
+            g = np.where(valid, regs[...,2], 0)/2**(self.dds.B_GAIN-1)
+            fi = 2*np.pi*regs[...,1]/2**self.dds.B_DDS
+            x = self.amplitude*g*np.exp(1j*fi)
+        if self.noise > 0:
+            x = x + self.noise*(self.rng.standard_normal(chs.shape) + 1j*self.rng.standard_normal(chs.shape))
+        return x
+
+    def __call__(self, buff):
+        L = self.chsel.L
+        trans = np.sort(np.asarray(self.chsel.dict['tran'], dtype=int))
+        if len(trans) == 0:
+            raise RuntimeError("%s: no transaction enabled, the DMA transfer would never complete" % self.streamer.fullpath)
+
+        packets = buff.reshape((-1, self.streamer.NS_TR))
+        n = len(packets)
+
+        # Transaction and frame of each packet.
+        k = self.n + np.arange(n)
+        tr = trans[k % len(trans)]
+        t = k // len(trans)
+        chs = tr[:,None]*L + np.arange(L)
+
+        # Samples, saturated to 16 bits.
+        x = self.signal(chs, t)
+        packets[:] = 0
+        packets[:,0:2*L:2] = np.clip(np.round(x.real), -2**15, 2**15-1)
+        packets[:,1:2*L:2] = np.clip(np.round(x.imag), -2**15, 2**15-1)
+        packets[:,2*L] = tr
+
+        self.n += n
+
+class SimReplaySource():
+    """
+    Replay of recorded DMA data (e.g. a buffer saved on the board), cyclically over transfers.
+    """
+    def __init__(self, data):
+        self.data = np.asarray(data).reshape(-1)
+
+        # Next word to send.
+        self.n = 0
+
+    def __call__(self, buff):
+        flat = buff.reshape(-1)
+        idx = (self.n + np.arange(len(flat))) % len(self.data)
+        flat[:] = self.data[idx]
+        self.n = (self.n + len(flat)) % len(self.data)
+
+class HwhParser():
+    """
+    Minimal .hwh reader: the subset of the PYNQ HWH parser used by MkidsSoc and QickMetadata.
+
+    Attributes root (XML root), ip_dict (addressable blocks), pins and nets (signal connectivity).
+    """
+    def __init__(self, hwhfile):
+        self.root = ET.parse(hwhfile).getroot()
+        self.ip_dict = {}
+        self.pins = {}
+        self.nets = {}
+
+        modules = {m.get('INSTANCE') : m for m in self.root.iter('MODULE')}
+
+        for mod in modules.values():
+            fullpath = mod.get('FULLNAME').lstrip('/')
+
+            # Signals.
+            for port in mod.findall('./PORTS/PORT'):
+                signame = port.get('SIGNAME')
+                if signame is None:
+                    continue
+                pin = fullpath + '/' + port.get('NAME')
+                self.pins[pin] = signame
+                self.nets.setdefault(signame, set()).add(pin)
+
+            # Addressable blocks: register ranges seen by the processing system.
+            if mod.get('MODTYPE', '').startswith('zynq_ultra_ps_e'):
+                for mr in mod.iter('MEMRANGE'):
+                    if mr.get('MEMTYPE') != 'REGISTER' or mr.get('INSTANCE') not in modules:
+                        continue
+                    ip = modules[mr.get('INSTANCE')]
+                    name = ip.get('FULLNAME').lstrip('/')
+                    if name in self.ip_dict:
+                        continue
+                    base = int(mr.get('BASEVALUE'), 16)
+                    high = int(mr.get('HIGHVALUE'), 16)
+                    self.ip_dict[name] = {  'fullpath'   : name,
+                                            'type'       : ip.get('VLNV'),
+                                            'phys_addr'  : base,
+                                            'addr_range' : high - base + 1,
+                                            'mem_id'     : mr.get('SLAVEBUSINTERFACE'),
+                                            'memtype'    : 'REGISTER',
+                                            'state'      : None,
+                                            'gpio'       : {},
+                                            'interrupts' : {},
+                                            'device'     : None,
+                                            'parameters' : {p.get('NAME') : p.get('VALUE')
+                                                            for p in ip.findall('./PARAMETERS/PARAMETER')}}
+
+class SimMkidsSoc(MkidsSoc):
+    """
+    MkidsSoc on simulated hardware, built from a .hwh file.
+    """
+    def __init__(self, hwhfile, board=None, latency=0, bandwidth=None, signal=None, amplitude=10000, noise=10, seed=None, topology_cache=False):
+        """
+        Parameters:
+        -----------
+            hwhfile: string
+                hardware description, e.g. mkids_v2/zcu216/mkids_2x2_kidsim_v2.hwh
+            board: string or None (Default None)
+                board name. None: from the directory of hwhfile (zcu111, zcu216)
+            latency: double (Default 0)
+                DMA latency (seconds)
+            bandwidth: double or None (Default None)
+                DMA bandwidth (bytes/second), None for no limit
+            signal: function or None (Default None)
+                signal(chs, t) giving the samples of channels chs, see SimStreamSource
+            amplitude, noise: doubles (Default 10000, 10)
+                loopback amplitude and noise rms of the default signal
+            seed: int or None (Default None)
+                seed of the noise
+            topology_cache: string, True, None or False (Default False)
+                topology cache file (see MkidsSoc), True for next to hwhfile, None or False to always trace
+        """
+        self.external_clk = None
+        self.clk_output = None
+        self.topology_cache = topology_cache
+
+        # Hardware description.
+        self.parser = HwhParser(hwhfile)
+        self.ip_dict = self.parser.ip_dict
+        self.bitfile_name = hwhfile
+
+        # Initialize the configuration
+        self._cfg = {}
+        QickConfig.__init__(self)
+
+        if board is None:
+            board = os.path.basename(os.path.dirname(os.path.abspath(hwhfile))).upper()
+        self['board'] = board
+
+        # Read the config to get a list of enabled ADCs and DACs, and the sampling frequencies.
+        self.list_rf_blocks(
+            self.ip_dict['usp_rf_data_converter_0']['parameters'])
+
+        # Drivers.
+        self.dma_cfg = {'latency' : latency, 'bandwidth' : bandwidth}
+        self.load_drivers()
+
+        # RF data converter.
+        self.rf = self.usp_rf_data_converter_0
+        self.rf.configure(self)
+
+        self.map_signal_paths()
+
+        # Data sources of the streamers.
+        for pfb in self.pfbs_in:
+            if pfb.HAS_STREAMER and pfb.HAS_CHSEL:
+                streamer = getattr(self, pfb.dict['streamer'])
+                chsel = getattr(self, pfb.dict['chsel'])
+                dds = getattr(self, pfb.dict['dds']) if pfb.HAS_DDS_DUAL else None
+                streamer.dma.recvchannel.source = SimStreamSource(streamer, chsel, dds, signal, amplitude, noise, seed)
+
+    def __getattr__(self, key):
+        # Every block is created by load_drivers(): no Overlay lookup.
+        raise AttributeError("%s has no attribute %s" % (self.__class__.__name__, key))
+
+    def __dir__(self):
+        return sorted(set(object.__dir__(self)))
+
+    def drivers(self):
+        """
+        Map VLNV -> driver class from the bindto of the SocIp drivers in memory.
+        """
+        drivers = {}
+        stack = [SocIp]
+        while len(stack) > 0:
+            cls = stack.pop()
+            stack.extend(cls.__subclasses__())
+            for vlnv in cls.__dict__.get('bindto', []):
+                drivers[vlnv] = cls
+                drivers[vlnv.rpartition(':')[0]] = cls
+        return drivers
+
+    def load_drivers(self):
+        """
+        Create the driver of every block of ip_dict on simulated registers.
+        """
+        drivers = self.drivers()
+
+        # Drivers create their MMIO in DefaultIP.__init__().
+        mmio = pynq.overlay.MMIO
+        pynq.overlay.MMIO = SimMMIO
+        try:
+            for name, desc in self.ip_dict.items():
+                vlnv = desc['type']
+                modtype = vlnv.split(':')[2]
+                if modtype == 'usp_rf_data_converter':
+                    cls = SimRFDC
+                elif modtype == 'axi_dma':
+                    cls = SimDma
+                elif vlnv in drivers:
+                    cls = drivers[vlnv]
+                else:
+                    cls = drivers.get(vlnv.rpartition(':')[0], DefaultIP)
+                desc['driver'] = cls
+
+                if cls is SimDma:
+                    ip = SimDma(desc, **self.dma_cfg)
+                else:
+                    ip = cls(desc)
+                if isinstance(ip, AxisStreamerV1):
+                    ip.allocate = sim_allocate
+                setattr(self, name, ip)
+        finally:
+            pynq.overlay.MMIO = mmio
+
+    def config_clocks(self, force_init_clks):
+        pass
+
+    def download(self):
+        pass
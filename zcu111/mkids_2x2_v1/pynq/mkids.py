@@ -853,6 +853,7 @@ class AxisStreamerV1(SocIp):
     # NSAMP_REG : number of samples per transaction (for TLAST generation).
     bindto = ['user.org:user:axis_streamer_v1:1.0']
     REGISTERS = {'start_reg' : 0, 'nsamp_reg' : 1}
+    DTYPE = np.int16
     
     def __init__(self, description):
         # Initialize ip
@@ -892,7 +893,7 @@ class AxisStreamerV1(SocIp):
         # Configure parameters.
         self.nsamp_reg  = nsamp
         nbuf = nsamp*self.NS_TR
-        self.buff = allocate(shape=(nbuf,), dtype=np.int16)
+        self.buff = allocate(shape=(nbuf,), dtype=self.DTYPE)
         
         # Update register value.
         self.stop()
@@ -910,7 +911,7 @@ class AxisStreamerV1(SocIp):
         # First dimention: number of dma transfers.
         # Second dimension: number of streamer transactions.
         # Third dimension: Number of I + Number of Q + Index (17 samples, 16-bit each).
-        data = np.zeros((nt,self.nsamp_reg,self.NS_NI))
+        data = np.zeros((nt,self.nsamp_reg,self.NS_NI), dtype=self.DTYPE)
         
         for i in np.arange(nt):
         
@@ -935,9 +936,9 @@ class AxisStreamerV1(SocIp):
         # Number of samples per transfer.
         ns = len(packets[0])
         
-        # Format data.
+        # Format data: packets stay int16, only the selected channel is converted.
         data_iq = packets[:,:,:16].reshape((-1,16)).T
-        xi,xq = data_iq[2*idx:2*idx+2]        
+        xi,xq = data_iq[2*idx:2*idx+2].astype(np.float32)
                 
         return [xi,xq]
 
@@ -948,7 +949,7 @@ class AxisStreamerV1(SocIp):
         # Format data.
         data = {'raw' : [], 'idx' : [], 'samples' : {}}
 
-        # Raw packets.
+        # Raw packets (int16, as received).
         data['raw'] = packets[:,:,:self.NS].reshape((-1,self.NS)).T
 
         # Active transactions.
@@ -972,16 +973,19 @@ class AxisStreamerV1(SocIp):
 
         return samples
 
-    async def transfer_async(self):
-        # DMA data.
-        self.dma.recvchannel.transfer(self.buff)
-        await self.dma.recvchannel.wait_async()
+    async def transfer_async(self,nt=1):
+        # Same as transfer(), but waiting for the DMA does not block the event loop.
+        data = np.zeros((nt,self.nsamp_reg,self.NS_NI), dtype=self.DTYPE)
 
-        # Format data.
-        data = self.buff & 0xFFFFF;
-        indx = (self.buff >> 24) & 0xFF;
+        for i in np.arange(nt):
+            # DMA data.
+            self.dma.recvchannel.transfer(self.buff)
+            await self.dma.recvchannel.wait_async()
 
-        return [indx,data]
+            # Same packet format as transfer().
+            data[i,:,:] = self.buff.reshape((self.nsamp_reg, -1))[:,:self.NS_NI]
+
+        return data
 
 class AxisDdsV2(SocIp):
     bindto = ['user.org:user:axis_dds_v2:1.0']